@@ -1,2 +1,3 @@
 kubectl apply -f kubernetes/services/
-kubectl apply -f kubernetes/deployments-v1/
\ No newline at end of file
+kubectl apply -f kubernetes/deployments-v1/
+kubectl apply -f kubernetes/jobs/
\ No newline at end of file
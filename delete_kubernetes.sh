@@ -1,3 +1,4 @@
+kubectl delete -f kubernetes/jobs/
 kubectl delete -f kubernetes/deployments-v1/
 kubectl delete -f kubernetes/deployments-v2/
 kubectl delete -f kubernetes/services/
\ No newline at end of file
@@ -1,76 +1,556 @@
+import functools
+import json
 import logging
-from urllib.parse import urlencode
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs, urlencode
 
 import requests
-from flask import Flask, request
+from flask import Flask, Response, request, jsonify, g
+
+import upstreams
+from balancer import Balancer
+from cache import BufferedResponse, ResponseCache, get_cache_key
+from headers import get_end_to_end_headers, get_request_headers
+from hedging import HedgingPolicy
+from limiter import AdaptiveLimiter, Overloaded
+from metrics import CONTENT_TYPE, Registry
+from pools import UpstreamPool
+from singleflight import SingleFlight
 
 app = Flask(__name__)
 PORT = 8080
 
-IOT = 'ms-iot.default.svc.cluster.local'
-ANOMALY_DETECTION = 'ms-anomaly-detection.default.svc.cluster.local'
-PREDICTION = 'ms-prediction.default.svc.cluster.local'
-ANALYTICS = 'ms-analytics.default.svc.cluster.local'
+CHUNK_SIZE = 64 * 1024  # in bytes
+
+# upstream response headers replaced by the ones of the gateway server
+SERVER_HEADERS = ('Server', 'Date')
+
+# response cache: memory bound in bytes and time to live per route in seconds
+CACHE_MAX_BYTES = 64 * 1024 * 1024
+CACHE_TTLS = {
+    '/api/detectAnomaly': 60,
+    '/api/predict': 300
+}
+
+# identical concurrent requests of these routes are forwarded only once
+COALESCED_ROUTES = {'/api/detectAnomaly', '/api/predict'}
+
+# hedged requests per route (opt-in), sent only if the upstream has several replicas in upstreams.REPLICAS:
+# percentile - percentile of recent latencies after which a second attempt is sent to another replica
+# budget_ratio - maximum number of hedges per request, at most 1.0
+HEDGED_ROUTES = {
+    '/api/predict': dict(percentile=95, budget_ratio=0.1)
+}
+HEDGE_WORKERS = 64
+
+# sub-requests of a batch run concurrently on a shared thread pool
+MAX_BATCH_SIZE = 100
+BATCH_WORKERS = 32
+
+cache = ResponseCache(CACHE_MAX_BYTES, CACHE_TTLS)
+flights = SingleFlight()
+pools = {upstream: UpstreamPool(upstream, hosts=len(upstreams.REPLICAS[upstream]), **settings)
+         for upstream, settings in upstreams.POOL_SETTINGS.items()}
+balancers = {upstream: Balancer(upstream, upstreams.REPLICAS[upstream], **settings)
+             for upstream, settings in upstreams.LOAD_BALANCER_SETTINGS.items()}
+limiters = {upstream: AdaptiveLimiter(upstream, **settings)
+            for upstream, settings in upstreams.LIMITER_SETTINGS.items()}
+hedging_policies = {route: HedgingPolicy(route, **settings) for route, settings in HEDGED_ROUTES.items()}
+hedge_executor = ThreadPoolExecutor(max_workers=HEDGE_WORKERS)
+batch_executor = ThreadPoolExecutor(max_workers=BATCH_WORKERS)
+
+registry = Registry()
+requests_total = registry.counter('gateway_requests_total', "Requests answered by the gateway.",
+                                  ('route', 'method', 'status'))
+request_duration = registry.histogram('gateway_request_duration_seconds',
+                                      "Time from receiving a request until its response is ready.", ('route',))
+overhead_duration = registry.histogram('gateway_overhead_duration_seconds',
+                                       "Time of a request spent in the gateway rather than waiting for an upstream.",
+                                       ('route',))
+upstream_duration = registry.histogram('gateway_upstream_duration_seconds',
+                                       "Time until an upstream answers with the response headers.",
+                                       ('route', 'upstream'))
+upstream_responses = registry.counter('gateway_upstream_responses_total', "Responses received from upstreams.",
+                                      ('route', 'upstream', 'status'))
+in_flight = registry.gauge('gateway_in_flight_requests', "Requests being handled by the gateway.", ('route',))
+upstream_in_flight = registry.gauge('gateway_upstream_in_flight_requests', "Requests waiting for an upstream.",
+                                    ('upstream',))
+request_bytes = registry.counter('gateway_request_bytes_total', "Bytes of request bodies received.", ('route',))
+response_bytes = registry.counter('gateway_response_bytes_total', "Bytes of response bodies sent.", ('route',))
+cache_lookups = registry.counter('gateway_cache_lookups_total', "Lookups in the response cache.", ('result',))
+cache_size = registry.gauge('gateway_cache_size_bytes', "Size of the cached responses.")
+coalesced_requests = registry.counter('gateway_coalesced_requests_total',
+                                      "Requests answered by joining an identical request in flight.")
+hedged_requests = registry.counter('gateway_hedged_requests_total', "Hedges sent to another replica.", ('route',))
+shed_requests = registry.counter('gateway_shed_requests_total', "Requests shed by the concurrency limiter.",
+                                 ('upstream',))
+concurrency_limit = registry.gauge('gateway_concurrency_limit', "Adaptive concurrency limit.", ('upstream',))
+pool_connections = registry.counter('gateway_pool_connections_opened_total', "Upstream connections opened.",
+                                    ('upstream',))
+
+
+class ProxiedRequest:
+    def __init__(self, route, query_params, headers, body):
+        self.route = route                  # string, gateway route
+        self.query_params = query_params    # string, encoded query parameters
+        self.headers = headers              # dict
+        self.body = body                    # bytes
+        self.upstream_time = None           # float, seconds until the first upstream answer
 
+    def get_accuracy(self):
+        """
+        Provide the prediction accuracy named in the JSON body, None if there is none.
+        """
+        if b'accuracy' not in self.body:
+            return None
+        try:
+            body = json.loads(self.body)
+        except ValueError:
+            return None
+        return body.get('accuracy') if isinstance(body, dict) else None
 
-def get_url(host, port, path):
-    url = f"http://{host}:{port}{path}"
+    def get_latency_key(self):
+        """
+        Group requests expected to take about as long: by route, and by prediction model and accuracy
+        when they are named, since a HIGH accuracy prediction runs over a much longer series than a LOW one.
+        """
+        key = self.route
+        model = parse_qs(self.query_params).get('predictionModel')
+        if model:
+            key += f"?predictionModel={model[0]}"
+        accuracy = self.get_accuracy()
+        if accuracy is not None:
+            key += f" accuracy={accuracy}"
+        return key
+
+
+def get_url(address, path):
+    url = f"http://{address}{path}"
     return url
 
 
+def get_route():
+    return request.url_rule.rule if request.url_rule is not None else 'unmatched'
+
+
+def get_proxied_request():
+    """
+    Capture the current request, so it can be forwarded outside of the request context.
+    """
+    g.proxied = ProxiedRequest(get_route(), request.query_string.decode(), get_request_headers(request.headers),
+                               request.get_data())
+    return g.proxied
+
+
+def forward(upstream, path, method='POST', proxied=None, tried=None, record=None):
+    """
+    Forward a request (by default the current one) to an upstream service over its keep-alive connection pool.
+    The request is shed with Overloaded when the upstream is at its concurrency limit,
+    otherwise it goes to the replica chosen by the load balancer of the upstream.
+    Replicas in the list tried are avoided and the chosen replica is appended to it.
+    The request holds its place in the concurrency limit until the returned response is closed.
+    Once admitted, its upstream latency in seconds is passed to record, if given, whether it succeeds or fails.
+    A request shed for want of a free connection in the gateway is not held against the replica or the limit.
+    """
+    if proxied is None:
+        proxied = get_proxied_request()
+    limiter = limiters[upstream]
+    limiter.acquire()
+    balancer = balancers[upstream]
+    if tried is None:
+        replica = balancer.pick()
+    else:
+        replica = balancer.pick(exclude=tried)
+        tried.append(replica)
+    url = get_url(replica.address, path + "?" + proxied.query_params)
+    upstream_in_flight.inc(upstream)
+    start = time.monotonic()
+    status = 'error'
+    response = None
+    try:
+        response = pools[upstream].request(method, url, data=proxied.body, headers=proxied.headers, stream=True)
+        status = response.status_code
+        return response
+    except Overloaded:
+        status = None
+        raise
+    finally:
+        upstream_in_flight.dec(upstream)
+        if status is None:
+            balancer.cancel(replica)
+            limiter.cancel()
+        else:
+            latency = time.monotonic() - start
+            failed = status == 'error' or status >= 500
+            balancer.release(replica, latency, failed)
+            release = functools.partial(limiter.release, latency, failed, proxied.get_latency_key())
+            if response is None:
+                release()
+            else:
+                release_on_close(response, release)
+            upstream_duration.observe(proxied.route, upstream, value=latency)
+            upstream_responses.inc(proxied.route, upstream, str(status))
+            if record is not None:
+                record(latency)
+            if proxied.upstream_time is None:
+                proxied.upstream_time = latency
+
+
+def release_on_close(response, release):
+    """
+    Call release once the response is first closed, that is once its body has been read or dropped.
+    """
+    close = response.close
+
+    def close_and_release():
+        nonlocal release
+        try:
+            close()
+        finally:
+            if release is not None:
+                callback, release = release, None
+                callback()
+
+    response.close = close_and_release
+
+
+def stream_body(response, route):
+    """
+    Stream the raw upstream body. The connection returns to the pool once the body has been read.
+    """
+    try:
+        for chunk in response.raw.stream(CHUNK_SIZE, decode_content=False):
+            response_bytes.inc(route, amount=len(chunk))
+            yield chunk
+    finally:
+        response.close()
+
+
 def create_response(response):
-    return response.json(), response.status_code, response.headers.items()
+    """
+    Pass the upstream status, end-to-end headers and body bytes through without decoding the body.
+    """
+    flask_response = Response(stream_body(response, get_route()), status=response.status_code,
+                              headers=get_end_to_end_headers(response.headers, skip=SERVER_HEADERS))
+    # the body generator does not run its cleanup if the client disconnects before the first chunk
+    flask_response.call_on_close(response.close)
+    return flask_response
+
+
+def read_response(response):
+    """
+    Read the whole raw upstream body and return the connection to the pool.
+    """
+    try:
+        body = response.raw.read(decode_content=False)
+    finally:
+        response.close()
+    headers = get_end_to_end_headers(response.headers, skip=SERVER_HEADERS)
+    return BufferedResponse(response.status_code, headers, body)
+
+
+def create_buffered_response(buffered, cache_status):
+    response = Response(buffered.body, status=buffered.status, headers=buffered.headers)
+    response.headers['X-Cache'] = cache_status
+    return response
+
+
+def forward_hedged(upstream, path, method, proxied):
+    """
+    Forward a request with the hedging policy of its route.
+    """
+    policy = hedging_policies[proxied.route]
+    balancer = balancers[upstream]
+
+    def attempt(tried):
+        return forward(upstream, path, method, proxied, tried, record=policy.record)
+
+    return policy.call(hedge_executor, attempt, balancer.has_alternative)
+
+
+def forward_shared(upstream, path, method, proxied):
+    """
+    Answer a repeated request from the response cache or join an identical request in flight,
+    forward it to the upstream service otherwise. Only successful responses are cached.
+
+    :return: the buffered response and whether it was a cache HIT or MISS
+    """
+    route = proxied.route
+    key = get_cache_key(route, proxied.query_params, proxied.body, proxied.headers)
+    if cache.is_cacheable(route):
+        buffered = cache.get(key)
+        if buffered is not None:
+            return buffered, 'HIT'
+
+    def fetch():
+        if is_hedged(upstream, route):
+            response = read_response(forward_hedged(upstream, path, method, proxied))
+        else:
+            response = read_response(forward(upstream, path, method, proxied))
+        if response.status == 200 and cache.is_cacheable(route):
+            cache.put(key, response)
+        return response
+
+    if route in COALESCED_ROUTES:
+        buffered = flights.do(key, fetch)
+    else:
+        buffered = fetch()
+    return buffered, 'MISS'
+
+
+def is_hedged(upstream, route):
+    """
+    Hedge the requests of a hedged route only if its upstream has another replica to send the hedge to.
+    """
+    return route in hedging_policies and len(balancers[upstream].replicas) > 1
+
+
+def is_shared(route):
+    return cache.is_cacheable(route) or route in COALESCED_ROUTES or route in hedging_policies
+
+
+def create_sub_request(item):
+    """
+    Create a proxied request from a sub-request of a batch with route, query and JSON body.
+    """
+    route = item['route']
+    if route not in upstreams.ROUTES:
+        raise ValueError(f"Unknown route {route}")
+    query = item.get('query') or {}
+    query_params = query if isinstance(query, str) else urlencode(query, doseq=True)
+    body = item.get('body')
+    body = json.dumps(body).encode() if body is not None else b''
+    headers = {'Content-Type': 'application/json', 'Accept-Encoding': 'identity'}
+    return ProxiedRequest(route, query_params, headers, body)
+
+
+def run_sub_request(proxied):
+    """
+    Forward a sub-request of a batch like a single request of its route and measure its time.
+    """
+    method, upstream, path = upstreams.ROUTES[proxied.route]
+    start = time.monotonic()
+    cache_status = None
+    try:
+        if is_shared(proxied.route):
+            buffered, cache_status = forward_shared(upstream, path, method, proxied)
+        else:
+            buffered = read_response(forward(upstream, path, method, proxied))
+        status = buffered.status
+        try:
+            body = json.loads(buffered.body) if buffered.body else None
+        except ValueError:
+            body = buffered.body.decode(errors='replace')
+    except Overloaded as err:
+        status, body = 503, dict(error=str(err), retry_after=err.retry_after)
+    except Exception as err:
+        logging.error(err)
+        status, body = 502, dict(error=str(err))
+    result = dict(route=proxied.route, status=status, time=(time.monotonic() - start) * 1000, body=body)
+    if cache_status is not None:
+        result['cache'] = cache_status
+    return result
+
+
+@app.before_request
+def start_request():
+    g.start = time.monotonic()
+    route = get_route()
+    in_flight.inc(route)
+    request_bytes.inc(route, amount=request.content_length or 0)
+
+
+@app.after_request
+def record_request(response):
+    """
+    Record the duration of a request, split into upstream time and gateway overhead.
+    Streamed response bodies are counted while they are sent.
+    """
+    route = get_route()
+    duration = time.monotonic() - g.start
+    requests_total.inc(route, request.method, str(response.status_code))
+    request_duration.observe(route, value=duration)
+    proxied = g.get('proxied')
+    if proxied is not None and proxied.upstream_time is not None:
+        overhead_duration.observe(route, value=max(duration - proxied.upstream_time, 0.0))
+    elif response.headers.get('X-Cache') == 'HIT':
+        overhead_duration.observe(route, value=duration)
+    if response.is_streamed:
+        # the request is in flight until its body has been sent, which is after the teardown
+        g.streamed = True
+        response.call_on_close(functools.partial(in_flight.dec, route))
+    else:
+        response_bytes.inc(route, amount=response.content_length or 0)
+    return response
+
+
+@app.teardown_request
+def finish_request(err):
+    if not g.get('streamed'):
+        in_flight.dec(get_route())
+
+
+@app.errorhandler(Overloaded)
+def shed_request(err):
+    """
+    Shed a request quickly when its upstream service is overloaded.
+    """
+    logging.warning(err)
+    return jsonify(dict(error=str(err))), 503, {'Retry-After': str(err.retry_after)}
+
+
+@app.errorhandler(requests.RequestException)
+def fail_request(err):
+    """
+    Answer with Gateway Timeout when an upstream service did not connect or answer in time,
+    with Bad Gateway when the connection to it failed otherwise.
+    """
+    logging.error(err)
+    status = 504 if isinstance(err, requests.Timeout) else 502
+    return jsonify(dict(error=str(err))), status
 
 
 @app.route('/api/generateSensorData', methods=['POST'])
 def generate_sensor_data():
-    query_params = urlencode(request.args)
-    url = get_url(IOT, PORT, '/v1/generateSensorData' + "?" + query_params)
-    response = requests.post(url, json=request.get_json())
-    response.headers.pop('Transfer-Encoding')
+    response = forward(upstreams.IOT, '/v1/generateSensorData')
     return create_response(response)
 
 
 @app.route('/api/detectAnomaly', methods=['POST'])
 def detect_anomaly():
-    query_params = urlencode(request.args)
-    url = get_url(ANOMALY_DETECTION, PORT, '/v1/detectAnomaly' + "?" + query_params)
-    response = requests.post(url, json=request.get_json())
-    return create_response(response)
+    buffered, cache_status = forward_shared(upstreams.ANOMALY_DETECTION, '/v1/detectAnomaly', 'POST',
+                                            get_proxied_request())
+    return create_buffered_response(buffered, cache_status)
 
 
 @app.route('/api/predict', methods=['POST'])
 def predict():
-    query_params = urlencode(request.args)
-    url = get_url(PREDICTION, PORT, '/v1/predict' + "?" + query_params)
-    response = requests.post(url, json=request.get_json())
-    return create_response(response)
+    buffered, cache_status = forward_shared(upstreams.PREDICTION_ADVANCED, '/v1/predict', 'POST',
+                                            get_proxied_request())
+    return create_buffered_response(buffered, cache_status)
 
 
 @app.route('/api/assessPredictions', methods=['POST'])
 def assess_predictions():
-    query_params = urlencode(request.args)
-    url = get_url(ANALYTICS, PORT, '/v1/assessPredictions' + "?" + query_params)
-    response = requests.post(url, json=request.get_json())
+    response = forward(upstreams.ANALYTICS, '/v1/assessPredictions')
     return create_response(response)
 
 
 @app.route('/api/getAccuratePrediction', methods=['POST'])
 def get_accurate_prediction():
-    query_params = urlencode(request.args)
-    url = get_url(ANALYTICS, PORT, '/v1/getAccuratePrediction' + "?" + query_params)
-    response = requests.post(url, json=request.get_json())
+    response = forward(upstreams.ANALYTICS, '/v1/getAccuratePrediction')
     return create_response(response)
 
 
 @app.route('/api/getValidPredictions', methods=['DELETE'])
 def get_valid_predictions():
-    query_params = urlencode(request.args)
-    url = get_url(ANALYTICS, PORT, '/v1/getValidPredictions' + "?" + query_params)
-    response = requests.delete(url, json=request.get_json())
+    response = forward(upstreams.ANALYTICS, '/v1/getValidPredictions', method='DELETE')
     return create_response(response)
 
 
+@app.route('/api/batch', methods=['POST'])
+def batch():
+    """
+    Run a list of sub-requests concurrently against the upstream services.
+    Each sub-request names a gateway route with optional query parameters and JSON body, e.g.
+    {"requests": [{"route": "/api/predict", "query": {"predictionModel": "Prophet"}, "body": {...}}]}
+
+    :return: the results in the order of the sub-requests with status, time in milliseconds and body
+    """
+    json_request = request.get_json()
+    items = json_request.get('requests') if isinstance(json_request, dict) else None
+    if not isinstance(items, list) or len(items) > MAX_BATCH_SIZE:
+        return jsonify(dict(error=f"Expected a list of at most {MAX_BATCH_SIZE} requests")), 400
+    try:
+        sub_requests = [create_sub_request(item) for item in items]
+    except (KeyError, TypeError, ValueError) as err:
+        return jsonify(dict(error=f"Invalid sub-request: {err}")), 400
+    logging.info(f"* Batch of {len(sub_requests)} requests")
+    results = list(batch_executor.map(run_sub_request, sub_requests))
+    return jsonify(dict(responses=results)), 200
+
+
+@app.route('/api/pools', methods=['GET'])
+def get_pools():
+    """
+    Provide usage counters of the upstream connection pools.
+    """
+    return jsonify({upstream: pool.stats() for upstream, pool in pools.items()}), 200
+
+
+@app.route('/api/replicas', methods=['GET'])
+def get_replicas():
+    """
+    Provide the load balancing state and latency of the upstream replicas.
+    """
+    return jsonify({upstream: balancer.stats() for upstream, balancer in balancers.items()}), 200
+
+
+@app.route('/api/limits', methods=['GET'])
+def get_limits():
+    """
+    Provide the adaptive concurrency limits of the upstream services.
+    """
+    return jsonify({upstream: limiter.stats() for upstream, limiter in limiters.items()}), 200
+
+
+@app.route('/api/cache', methods=['GET'])
+def get_cache():
+    """
+    Provide hit and miss counters of the response cache.
+    """
+    return jsonify(cache.stats()), 200
+
+
+@app.route('/api/cache', methods=['DELETE'])
+def purge_cache():
+    """
+    Purge the response cache, optionally only the entries of the route given as query parameter.
+    """
+    route = request.args.get('route')
+    purged = cache.purge(route)
+    logging.info(f"Purged {purged} cached responses")
+    return jsonify(dict(purged=purged)), 200
+
+
+@app.route('/api/coalescing', methods=['GET'])
+def get_coalescing():
+    """
+    Provide counters of forwarded and coalesced requests.
+    """
+    return jsonify(flights.stats()), 200
+
+
+@app.route('/api/hedging', methods=['GET'])
+def get_hedging():
+    """
+    Provide counters of hedged requests per route.
+    """
+    return jsonify({route: policy.stats() for route, policy in hedging_policies.items()}), 200
+
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """
+    Provide the gateway metrics in the Prometheus text format.
+    """
+    cache_stats = cache.stats()
+    cache_lookups.set('hit', value=cache_stats['hits'])
+    cache_lookups.set('miss', value=cache_stats['misses'])
+    cache_size.set(value=cache_stats['size'])
+    coalesced_requests.set(value=flights.stats()['coalesced'])
+    for route, policy in hedging_policies.items():
+        hedged_requests.set(route, value=policy.stats()['hedges'])
+    for upstream, limiter in limiters.items():
+        limiter_stats = limiter.stats()
+        shed_requests.set(upstream, value=limiter_stats['shed'])
+        concurrency_limit.set(upstream, value=limiter_stats['limit'])
+    for upstream, pool in pools.items():
+        pool_connections.set(upstream, value=pool.stats()['connections_opened'])
+    return Response(registry.render(), status=200, content_type=CONTENT_TYPE)
+
+
 if __name__ == '__main__':
     logging.getLogger().setLevel(logging.DEBUG)
     app.run(host='0.0.0.0', port=PORT, debug=True)
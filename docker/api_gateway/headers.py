@@ -0,0 +1,33 @@
+# headers that apply to a single connection and must not be forwarded by a proxy (RFC 7230, section 6.1)
+HOP_BY_HOP_HEADERS = {
+    'connection',
+    'keep-alive',
+    'proxy-authenticate',
+    'proxy-authorization',
+    'te',
+    'trailer',
+    'trailers',
+    'transfer-encoding',
+    'upgrade'
+}
+
+
+def get_end_to_end_headers(headers, skip=()):
+    """
+    Remove hop-by-hop headers incl. the ones listed in the Connection header.
+    """
+    connection = headers.get('Connection', '')
+    excluded = HOP_BY_HOP_HEADERS.union(token.strip().lower() for token in connection.split(','))
+    excluded.update(name.lower() for name in skip)
+    return [(name, value) for name, value in headers.items() if name.lower() not in excluded]
+
+
+def get_request_headers(headers):
+    """
+    Provide the end-to-end headers of a client request to be forwarded upstream.
+    The body is forwarded unchanged, so the upstream must not compress it unless the client accepts it.
+    """
+    request_headers = dict(get_end_to_end_headers(headers, skip=('Host',)))
+    if not any(name.lower() == 'accept-encoding' for name in request_headers):
+        request_headers['Accept-Encoding'] = 'identity'
+    return request_headers
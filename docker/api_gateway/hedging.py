@@ -0,0 +1,106 @@
+import logging
+import math
+import threading
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, wait
+
+
+def close_response(future):
+    """
+    Discard the response of an attempt that lost the race.
+    """
+    if not future.cancelled() and future.exception() is None:
+        future.result().close()
+
+
+class HedgingPolicy:
+    """
+    Hedged requests of a gateway route to cut tail latency.
+    When the first attempt has not answered within the given percentile of recent attempt latencies,
+    a second attempt goes to another replica and the first response wins.
+    Every request earns budget_ratio hedges and each hedge spends one,
+    so hedges never exceed budget_ratio times the requests and at most double the upstream load.
+    """
+
+    MAX_TOKENS = 10.0  # maximum number of hedges saved up for a burst
+
+    def __init__(self, route, percentile=95, window=1000, min_samples=20, budget_ratio=0.1):
+        self.route = route                              # string
+        self.percentile = percentile                    # float, 0 - 100
+        self.latencies = deque(maxlen=window)           # recent attempt latencies in seconds
+        self.min_samples = min_samples                  # int
+        self.budget_ratio = min(budget_ratio, 1.0)      # float, at most one hedge per request
+        self.lock = threading.Lock()
+        self.tokens = 0.0
+        self.requests = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+
+    def record(self, latency):
+        with self.lock:
+            self.latencies.append(latency)
+
+    def get_delay(self):
+        """
+        Provide the hedging delay in seconds, None while there are too few samples.
+        """
+        with self.lock:
+            if len(self.latencies) < self.min_samples:
+                return None
+            latencies = sorted(self.latencies)
+        index = min(math.ceil(len(latencies) * self.percentile / 100) - 1, len(latencies) - 1)
+        return latencies[max(index, 0)]
+
+    def earn(self):
+        with self.lock:
+            self.requests += 1
+            self.tokens = min(self.tokens + self.budget_ratio, self.MAX_TOKENS)
+
+    def spend(self):
+        with self.lock:
+            if self.tokens < 1.0:
+                return False
+            self.tokens -= 1.0
+            self.hedges += 1
+            return True
+
+    def call(self, executor, attempt, can_hedge):
+        """
+        Run attempt(tried) with a hedge if it is slow and return the first successful response,
+        otherwise the response of the earliest attempt that got one, or raise the error of the first attempt.
+        tried collects the replicas used by the attempts, so a hedge avoids the replica of the first attempt.
+        can_hedge(tried) tells whether another replica is available, otherwise no hedge is sent,
+        since a hedge to the same busy replica only adds to its load.
+        The losing attempt is cancelled, or its response is discarded when it arrives.
+        """
+        self.earn()
+        tried = []
+        attempts = [executor.submit(attempt, tried)]
+        delay = self.get_delay()
+        if delay is not None:
+            done, pending = wait(attempts, timeout=delay)
+            if pending and tried and can_hedge(tried) and self.spend():
+                logging.debug(f"Hedging {self.route} after {delay:.3f} seconds")
+                attempts.append(executor.submit(attempt, tried))
+        pending = set(attempts)
+        winner = None
+        while pending and winner is None:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None and future.result().status_code < 500 and winner is None:
+                    winner = future
+        if winner is not None and winner is not attempts[0]:
+            with self.lock:
+                self.hedge_wins += 1
+        if winner is None:
+            # no attempt succeeded: an upstream response, even an error one, beats a shed or failed attempt
+            winner = next((future for future in attempts if future.exception() is None), attempts[0])
+        for future in attempts:
+            if future is not winner and not future.cancel():
+                future.add_done_callback(close_response)
+        return winner.result()
+
+    def stats(self):
+        with self.lock:
+            return dict(requests=self.requests, hedges=self.hedges, hedge_wins=self.hedge_wins,
+                        budget=self.tokens, samples=len(self.latencies))
@@ -0,0 +1,126 @@
+import argparse
+import logging
+import time
+
+import psycopg2
+
+TABLE = 'aggregated_data'
+VERSION_TABLE = 'schema_migrations'
+
+# covering index columns need PostgreSQL 11, kubernetes/deployments-v1 runs 10.1
+COVERING_COLUMNS = " INCLUDE (data_value)"
+MIN_COVERING_VERSION = 110000
+
+# version, name and statements of the migrations, in order. Indexes are built concurrently,
+# so ms_fog keeps writing aggregated data while they are created.
+MIGRATIONS = [
+    (1, 'series indexes', [
+        # the range queries of a series, the series catalog and the true value lookup
+        f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {TABLE}_series_idx ON {TABLE}"
+        f" (data_type, aggregation_mode, aggregation_interval, timestamp){COVERING_COLUMNS}",
+        # the month and month/day filters of the predictions, in timestamp order within a month,
+        # so the day filter only skips the days of that month
+        f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {TABLE}_series_month_idx ON {TABLE}"
+        f" (data_type, aggregation_mode, aggregation_interval, (DATE_PART('month', timestamp)), timestamp)"
+        f"{COVERING_COLUMNS}",
+        f"ANALYZE {TABLE}",
+    ]),
+]
+
+
+def wait_for_table(conn, timeout):
+    """
+    Wait for ms_fog to create the aggregated data table on its first start.
+    """
+    deadline = time.monotonic() + timeout
+    with conn.cursor() as cur:
+        while True:
+            cur.execute("SELECT to_regclass(%s)", [TABLE])
+            if cur.fetchone()[0] is not None:
+                return
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"Table {TABLE} does not exist after {timeout} seconds")
+            time.sleep(1)
+
+
+def get_applied_versions(cur):
+    cur.execute(f"CREATE TABLE IF NOT EXISTS {VERSION_TABLE} (version integer PRIMARY KEY,"
+                f" name varchar(255), applied_at timestamp with time zone DEFAULT now())")
+    cur.execute(f"SELECT version FROM {VERSION_TABLE}")
+    return {row[0] for row in cur.fetchall()}
+
+
+def drop_invalid_indexes(cur):
+    """
+    Drop indexes left invalid by an interrupted concurrent build, so they are built again.
+    """
+    cur.execute("SELECT indexrelid::regclass::text FROM pg_index"
+                " WHERE indrelid = to_regclass(%s) AND NOT indisvalid", [TABLE])
+    for index, in cur.fetchall():
+        logging.warning(f"Dropping invalid index {index}")
+        cur.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {index}")
+
+
+def adapt(statement, server_version):
+    """
+    Leave out the covering columns of an index on servers which do not support them.
+    """
+    if server_version < MIN_COVERING_VERSION:
+        return statement.replace(COVERING_COLUMNS, '')
+    return statement
+
+
+def migrate(conn, dry_run=False):
+    """
+    Apply the migrations which have not been applied yet, and provide their versions.
+    Concurrent index builds cannot run in a transaction, so the connection is switched to autocommit.
+    """
+    conn.autocommit = True
+    if conn.server_version < MIN_COVERING_VERSION:
+        logging.warning(f"PostgreSQL {conn.server_version} does not support covering indexes, "
+                        f"the series indexes are built without{COVERING_COLUMNS}")
+    applied = []
+    with conn.cursor() as cur:
+        versions = get_applied_versions(cur)
+        for version, name, statements in MIGRATIONS:
+            if version in versions:
+                continue
+            logging.info(f"Applying migration {version}: {name}")
+            if not dry_run:
+                drop_invalid_indexes(cur)
+            for statement in statements:
+                statement = adapt(statement, conn.server_version)
+                logging.info(statement)
+                if not dry_run:
+                    cur.execute(statement)
+            if not dry_run:
+                cur.execute(f"INSERT INTO {VERSION_TABLE} (version, name) VALUES (%s, %s)", [version, name])
+            applied.append(version)
+    return applied
+
+
+def main():
+    parser = argparse.ArgumentParser(description=f"Create the indexes the Python services need on {TABLE}.")
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=5432)
+    parser.add_argument('--database', default='postgres')
+    parser.add_argument('--user', default='postgres')
+    parser.add_argument('--password', default='password')
+    parser.add_argument('--wait', type=float, default=0,
+                        help=f"seconds to wait for ms_fog to create {TABLE}")
+    parser.add_argument('--dry-run', action='store_true', help="log the statements without running them")
+    args = parser.parse_args()
+    conn = psycopg2.connect(host=args.host, port=args.port, database=args.database, user=args.user,
+                            password=args.password)
+    conn.autocommit = True
+    try:
+        wait_for_table(conn, args.wait)
+        applied = migrate(conn, args.dry_run)
+        logging.info(f"Applied migrations {applied}" if applied else "Nothing to migrate")
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    logging.getLogger().setLevel(logging.INFO)
+    main()
@@ -8,13 +8,13 @@ from flask import Flask, request
 from flask import jsonify, abort, make_response
 from sklearn.metrics import mean_squared_error
 
+import connection_pool
+import queries
 import thresholds
 
 app = Flask(__name__)
 PORT = 8080
 
-TABLE = 'aggregated_data'
-
 
 class Prediction(object):
     def __init__(self, dt_prediction):
@@ -27,15 +27,19 @@ class Prediction(object):
 
 def get_db_connection():
     """
-    Create a new database connection.
+    Create a new database connection for the connection pool, with the prepared queries.
     """
     conn = psycopg2.connect(host='postgres',
                             database='postgres',
                             user='postgres',
                             password='password')
+    queries.prepare(conn)
     return conn
 
 
+pool = connection_pool.ConnectionPool(get_db_connection)
+
+
 def convert_predictions(dt_predictions):
     """
     Convert predictions from dictionaries to class objects.
@@ -81,19 +85,14 @@ def extract_true_value(date, aggregation_mode, aggregation_interval, data_type):
     Extract true value from a database.
     """
     try:
-        conn = get_db_connection()
-        cur = conn.cursor()
-        cur.execute(f"SELECT data_value FROM {TABLE}"
-                    f" WHERE timestamp = '{date}' AND aggregation_mode = '{aggregation_mode}'"
-                    f" AND aggregation_interval = '{aggregation_interval}' AND data_type = '{data_type}'")
-        if cur.rowcount > 0:
-            true_value = cur.fetchone()[0]
-            cur.close()
-            conn.close()
-            return true_value
-        else:
-            logging.error("True value is not available")
-            abort(400)
+        with pool.connection() as conn, conn.cursor() as cur:
+            queries.execute(cur, 'true_value', [date, aggregation_mode, aggregation_interval, data_type])
+            if cur.rowcount > 0:
+                true_value = cur.fetchone()[0]
+                return true_value
+            else:
+                logging.error("True value is not available")
+                abort(400)
     except (Exception, psycopg2.DatabaseError, psycopg2.OperationalError) as err:
         logging.error(err)
         abort(400)
@@ -262,6 +261,16 @@ def get_valid_predictions():
     return create_response(dt_predictions, 200)
 
 
+@app.route('/v1/connectionPool', methods=['GET'])
+def get_connection_pool():
+    """
+    Report the usage of the database connection pool, incl. the time requests waited for a connection.
+
+    :return: pool usage counters and a 200 OK response
+    """
+    return create_response(pool.stats(), 200)
+
+
 def create_response(body, code):
     response = make_response(
         jsonify(body),
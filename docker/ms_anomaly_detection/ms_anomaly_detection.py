@@ -8,6 +8,11 @@ from adtk.detector import GeneralizedESDTestAD, ThresholdAD
 from flask import Flask, request
 from flask import jsonify, abort, make_response
 
+import binary_copy
+import connection_pool
+import queries
+import series_catalog
+
 app = Flask(__name__)
 PORT = 8080
 
@@ -15,34 +20,33 @@ YEAR = 'YEAR'
 MONTH = 'MONTH'
 DAY = 'DAY'
 
-TABLE = 'aggregated_data'
-
 
 def get_db_connection():
     """
-    Create a new database connection.
+    Create a new database connection for the connection pool, with the prepared queries.
     """
     conn = psycopg2.connect(host='postgres',
                             database='postgres',
                             user='postgres',
                             password='password')
+    queries.prepare(conn)
     return conn
 
 
+pool = connection_pool.ConnectionPool(get_db_connection)
+catalog = series_catalog.SeriesCatalog(pool)
+
+
 def get_query(data_type, aggregation_mode, aggregation_interval, start_date, end_date):
     """
-    Define a query for extracting data from a database.
+    Choose a series query and its parameters for extracting data from a database.
     """
-    query = f"SELECT data_value, timestamp FROM {TABLE}" \
-            f" WHERE data_type = '{data_type}'" \
-            f" AND aggregation_mode = '{aggregation_mode}'" \
-            f" AND aggregation_interval = '{aggregation_interval}'"
+    params = [data_type, aggregation_mode, aggregation_interval]
     if (start_date is not None) and (end_date is not None):
         str_start_date = datetime.datetime.strftime(start_date, "%Y-%m-%d")
         str_end_date = datetime.datetime.strftime(end_date, "%Y-%m-%d")
-        query = query + f" AND '[{str_start_date}, {str_end_date}]'::daterange @> timestamp"
-    query = query + f" ORDER BY timestamp"
-    return query
+        return 'series_range', params + [str_start_date, str_end_date]
+    return 'series', params
 
 
 def extract(data_type, start_date=None, end_date=None):
@@ -50,23 +54,20 @@ def extract(data_type, start_date=None, end_date=None):
     Extract data from a database.
     """
     try:
-        conn = get_db_connection()
-        cur = conn.cursor()
-        cur.execute(f"SELECT aggregation_mode, aggregation_interval"
-                    f" FROM {TABLE} WHERE data_type = '{data_type}'")
-        if cur.rowcount > 0:
-            aggregation_mode, aggregation_interval = cur.fetchone()
-            query = get_query(data_type, aggregation_mode, aggregation_interval, start_date, end_date)
-            logging.debug(f"Anomaly query:\n{query}")
-            cur.execute(query)
-            if cur.rowcount > 0:
-                df = pd.DataFrame(cur.fetchall(), columns=['data_value', 'timestamp'])
-                cur.close()
-                conn.close()
-                return df, aggregation_mode, aggregation_interval
-            else:
-                logging.error("Not enough data to detect")
-                abort(400)
+        series = catalog.get_series(data_type)
+        if series is not None:
+            aggregation_mode, aggregation_interval = series.aggregation_mode, series.aggregation_interval
+            name, params = get_query(data_type, aggregation_mode, aggregation_interval, start_date, end_date)
+            logging.debug(f"Anomaly query:\n{name} {params}")
+            with pool.connection() as conn, conn.cursor() as cur:
+                rows = series.estimate_rows(start_date, end_date)
+                values, timestamps = binary_copy.fetch_series(cur, name, params, rows)
+                if values.size > 0:
+                    df = pd.DataFrame({'data_value': values, 'timestamp': timestamps})
+                    return df, aggregation_mode, aggregation_interval
+                else:
+                    logging.error("Not enough data to detect")
+                    abort(400)
         else:
             logging.error("No data of this type")
             abort(400)
@@ -232,6 +233,26 @@ def clean_anomaly():
     return create_response(json_response, 200)
 
 
+@app.route('/v1/connectionPool', methods=['GET'])
+def get_connection_pool():
+    """
+    Report the usage of the database connection pool, incl. the time requests waited for a connection.
+
+    :return: pool usage counters and a 200 OK response
+    """
+    return create_response(pool.stats(), 200)
+
+
+@app.route('/v1/seriesCatalog', methods=['GET'])
+def get_series_catalog():
+    """
+    Report the series catalog: every data type with its aggregation, row count and timestamp range.
+
+    :return: the series catalog and a 200 OK response
+    """
+    return create_response(catalog.stats(), 200)
+
+
 def create_response(body, code):
     response = make_response(
         jsonify(body),
@@ -0,0 +1,60 @@
+import io
+
+import numpy as np
+
+import queries
+
+SIGNATURE = b'PGCOPY\n\xff\r\n\x00'
+HEADER_SIZE = len(SIGNATURE) + 8    # signature, flags and length of the header extension
+TRAILER = b'\xff\xff'
+POSTGRES_EPOCH = np.datetime64('2000-01-01', 'D')
+
+# Series of at least this many rows are extracted with binary COPY, smaller ones with their prepared statement.
+# COPY plans the query again, but saves about 1.3 microseconds per row of converting fetched rows.
+COPY_MIN_ROWS = 500
+
+# a row of data_value and timestamp: field count, then length and value of every field, in network byte order
+ROW = np.dtype([('fields', '>i2'), ('value_length', '>i4'), ('value', '>f8'), ('date_length', '>i4'),
+                ('date', '>i4')])
+
+
+def decode(data):
+    """
+    Decode binary COPY data of data_value and timestamp rows into float64 values and datetime64 timestamps,
+    without creating a Python object per row. Every row has the same size, as long as no field is NULL.
+    """
+    if not data.startswith(SIGNATURE):
+        raise ValueError("Not binary COPY data")
+    extension_length = int.from_bytes(data[HEADER_SIZE - 4:HEADER_SIZE], 'big')
+    start = HEADER_SIZE + extension_length
+    end = len(data) - len(TRAILER)
+    if data[end:] != TRAILER or (end - start) % ROW.itemsize:
+        raise ValueError("Binary COPY data with NULL fields or unexpected columns")
+    rows = np.frombuffer(data, ROW, count=(end - start) // ROW.itemsize, offset=start)
+    if np.any(rows['fields'] != 2) or np.any(rows['value_length'] != 8) or np.any(rows['date_length'] != 4):
+        raise ValueError("Binary COPY data with NULL fields or unexpected columns")
+    values = rows['value'].astype(np.float64)
+    timestamps = (POSTGRES_EPOCH + rows['date'].astype('timedelta64[D]')).astype('datetime64[ns]')
+    return values, timestamps
+
+
+def convert(rows):
+    """
+    Convert fetched data_value and timestamp rows into the arrays decode provides.
+    """
+    values = np.array([row[0] for row in rows], dtype=np.float64)
+    timestamps = np.array([row[1] for row in rows], dtype='datetime64[D]').astype('datetime64[ns]')
+    return values, timestamps
+
+
+def fetch_series(cur, name, params, rows):
+    """
+    Extract a series as arrays of values and timestamps, given the number of rows expected in its date range:
+    with binary COPY from COPY_MIN_ROWS rows on, with the prepared statement below.
+    """
+    if rows * queries.FILTER_SHARES.get(name, 1) < COPY_MIN_ROWS:
+        queries.execute(cur, name, params)
+        return convert(cur.fetchall())
+    file = io.BytesIO()
+    queries.copy(cur, name, params, file)
+    return decode(file.getvalue())
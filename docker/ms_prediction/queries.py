@@ -0,0 +1,84 @@
+import re
+
+TABLE = 'aggregated_data'
+
+# name: parameter types and statement, prepared once per database connection.
+# The predicates match the indexes of migrations/migrate.py: plain ranges on timestamp,
+# and DATE_PART('month', timestamp) exactly as indexed.
+STATEMENTS = {
+    'series_catalog': (
+        [],
+        f"SELECT data_type, aggregation_mode, aggregation_interval, COUNT(*), MIN(timestamp), MAX(timestamp)"
+        f" FROM {TABLE} GROUP BY data_type, aggregation_mode, aggregation_interval"),
+    'series': (
+        ['varchar', 'varchar', 'varchar'],
+        f"SELECT data_value, timestamp FROM {TABLE}"
+        f" WHERE data_type = $1 AND aggregation_mode = $2 AND aggregation_interval = $3"
+        f" ORDER BY timestamp"),
+    'series_range': (
+        ['varchar', 'varchar', 'varchar', 'date', 'date'],
+        f"SELECT data_value, timestamp FROM {TABLE}"
+        f" WHERE data_type = $1 AND aggregation_mode = $2 AND aggregation_interval = $3"
+        f" AND timestamp >= $4 AND timestamp <= $5"
+        f" ORDER BY timestamp"),
+    'series_range_month': (
+        ['varchar', 'varchar', 'varchar', 'date', 'date', 'int'],
+        f"SELECT data_value, timestamp FROM {TABLE}"
+        f" WHERE data_type = $1 AND aggregation_mode = $2 AND aggregation_interval = $3"
+        f" AND timestamp >= $4 AND timestamp <= $5"
+        f" AND DATE_PART('month', timestamp) = $6"
+        f" ORDER BY timestamp"),
+    'series_range_month_day': (
+        ['varchar', 'varchar', 'varchar', 'date', 'date', 'int', 'int'],
+        f"SELECT data_value, timestamp FROM {TABLE}"
+        f" WHERE data_type = $1 AND aggregation_mode = $2 AND aggregation_interval = $3"
+        f" AND timestamp >= $4 AND timestamp <= $5"
+        f" AND DATE_PART('month', timestamp) = $6 AND DATE_PART('day', timestamp) <= $7"
+        f" ORDER BY timestamp"),
+    'true_value': (
+        ['date', 'varchar', 'varchar', 'varchar'],
+        f"SELECT data_value FROM {TABLE}"
+        f" WHERE timestamp = $1 AND aggregation_mode = $2 AND aggregation_interval = $3 AND data_type = $4"),
+}
+
+# name: largest share of the rows in the date range that the month and day filters of a series statement keep
+FILTER_SHARES = {
+    'series_range_month': 1 / 12,
+    'series_range_month_day': 1 / 12,
+}
+
+
+def get_list(items):
+    """
+    Format the parameter list of PREPARE and EXECUTE, which is left out for statements without parameters.
+    """
+    return f" ({', '.join(items)})" if items else ''
+
+
+def prepare(conn):
+    """
+    Prepare the statements on a new connection, so Postgres parses and plans them once per connection
+    instead of once per request. Prepared statements last as long as the connection.
+    """
+    with conn.cursor() as cur:
+        for name, (types, statement) in STATEMENTS.items():
+            cur.execute(f"PREPARE {name}{get_list(types)} AS {statement}")
+    conn.commit()
+
+
+def execute(cur, name, params):
+    """
+    Execute a prepared statement. The parameters are passed to the driver to escape, never formatted into SQL.
+    """
+    cur.execute(f"EXECUTE {name}{get_list(['%s'] * len(params))}", params)
+
+
+def copy(cur, name, params, file):
+    """
+    Write the result of a statement to a file in the binary COPY format.
+    COPY cannot execute a prepared statement and takes no parameters, so the statement is parsed and planned
+    again, with its parameters escaped by the driver in place of $1, $2, ... which are numbered in order.
+    """
+    statement = re.sub(r'\$\d+', '%s', STATEMENTS[name][1])
+    query = cur.mogrify(statement, params).decode()
+    cur.copy_expert(f"COPY ({query}) TO STDOUT (FORMAT binary)", file)
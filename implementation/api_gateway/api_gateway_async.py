@@ -0,0 +1,143 @@
+import asyncio
+import logging
+import time
+
+from aiohttp import web, ClientSession, ClientTimeout, TCPConnector, ClientError
+
+import upstreams
+from balancer import Balancer
+from headers import get_end_to_end_headers, get_request_headers
+from metrics import CONTENT_TYPE, Registry
+
+PORT = 8091
+
+CHUNK_SIZE = 64 * 1024  # in bytes
+
+balancers = {upstream: Balancer(upstream, upstreams.REPLICAS[upstream], **settings)
+             for upstream, settings in upstreams.LOAD_BALANCER_SETTINGS.items()}
+
+registry = Registry()
+requests_total = registry.counter('gateway_requests_total', "Requests answered by the gateway.",
+                                  ('route', 'method', 'status'))
+request_duration = registry.histogram('gateway_request_duration_seconds',
+                                      "Time from receiving a request until its response body has been sent.",
+                                      ('route',))
+overhead_duration = registry.histogram('gateway_overhead_duration_seconds',
+                                       "Time of a request spent in the gateway rather than waiting for an upstream.",
+                                       ('route',))
+upstream_duration = registry.histogram('gateway_upstream_duration_seconds',
+                                       "Time until an upstream answers with the response headers.",
+                                       ('route', 'upstream'))
+upstream_responses = registry.counter('gateway_upstream_responses_total', "Responses received from upstreams.",
+                                      ('route', 'upstream', 'status'))
+in_flight = registry.gauge('gateway_in_flight_requests', "Requests being handled by the gateway.", ('route',))
+request_bytes = registry.counter('gateway_request_bytes_total', "Bytes of request bodies received.", ('route',))
+response_bytes = registry.counter('gateway_response_bytes_total', "Bytes of response bodies sent.", ('route',))
+
+
+def get_url(address, path):
+    url = f"http://{address}{path}"
+    return url
+
+
+async def create_sessions(app):
+    """
+    Open one non-blocking client session per upstream and close them on shutdown.
+    Kept-alive connections are closed after the idle timeout of the upstream.
+    The number of concurrent connections is not limited, so in-flight calls never queue in the gateway.
+    Calls fail once connecting or waiting for a read takes longer than the timeouts of the upstream,
+    while a response streamed for longer is not cut off.
+    """
+    app['sessions'] = {}
+    for upstream, settings in upstreams.POOL_SETTINGS.items():
+        connector = TCPConnector(limit=0, keepalive_timeout=settings['idle_timeout'])
+        timeout = ClientTimeout(total=None, sock_connect=settings['connect_timeout'],
+                                sock_read=settings['read_timeout'])
+        app['sessions'][upstream] = ClientSession(connector=connector, timeout=timeout, auto_decompress=False)
+    yield
+    for session in app['sessions'].values():
+        await session.close()
+
+
+async def count_chunks(chunks, route):
+    async for chunk in chunks:
+        request_bytes.inc(route, amount=len(chunk))
+        yield chunk
+
+
+def create_handler(route, method, upstream, path):
+    """
+    Create a handler streaming the request body to an upstream and the upstream response body back.
+    The gateway overhead is the time until the response headers are sent, less the upstream time,
+    like the time until the response is ready in api_gateway.py.
+    """
+    async def handler(request):
+        received = time.monotonic()
+        session = request.app['sessions'][upstream]
+        balancer = balancers[upstream]
+        headers = get_request_headers(request.headers)
+        data = count_chunks(request.content.iter_chunked(CHUNK_SIZE), route) if request.body_exists else None
+        in_flight.inc(route)
+        replica = balancer.pick()
+        released = False
+        start = time.monotonic()
+        status = 502
+        try:
+            try:
+                response = await session.request(method, get_url(replica.address, path), params=request.query,
+                                                 headers=headers, data=data)
+            except (ClientError, asyncio.TimeoutError) as err:
+                latency = time.monotonic() - start
+                balancer.release(replica, latency, failed=True)
+                released = True
+                upstream_duration.observe(route, upstream, value=latency)
+                upstream_responses.inc(route, upstream, 'error')
+                logging.error(f"{upstream}: {err}")
+                raise web.HTTPBadGateway()
+            latency = time.monotonic() - start
+            balancer.release(replica, latency, failed=response.status >= 500)
+            released = True
+            upstream_duration.observe(route, upstream, value=latency)
+            upstream_responses.inc(route, upstream, str(response.status))
+            status = response.status
+            try:
+                stream = web.StreamResponse(status=response.status, reason=response.reason,
+                                            headers=get_end_to_end_headers(response.headers))
+                await stream.prepare(request)
+                overhead_duration.observe(route, value=max(time.monotonic() - received - latency, 0.0))
+                async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+                    response_bytes.inc(route, amount=len(chunk))
+                    await stream.write(chunk)
+                await stream.write_eof()
+                return stream
+            finally:
+                response.release()
+        finally:
+            if not released:
+                # the client went away or the call broke unexpectedly, which says nothing about the replica
+                balancer.cancel(replica)
+            in_flight.dec(route)
+            requests_total.inc(route, method, str(status))
+            request_duration.observe(route, value=time.monotonic() - received)
+    return handler
+
+
+async def get_metrics(request):
+    """
+    Provide the gateway metrics in the Prometheus text format.
+    """
+    return web.Response(body=registry.render().encode(), headers={'Content-Type': CONTENT_TYPE})
+
+
+def create_app():
+    app = web.Application()
+    app.cleanup_ctx.append(create_sessions)
+    for route, (method, upstream, path) in upstreams.ROUTES.items():
+        app.router.add_route(method, route, create_handler(route, method, upstream, path))
+    app.router.add_get('/metrics', get_metrics)
+    return app
+
+
+if __name__ == '__main__':
+    logging.getLogger().setLevel(logging.DEBUG)
+    web.run_app(create_app(), host='0.0.0.0', port=PORT)
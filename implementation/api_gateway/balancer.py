@@ -0,0 +1,120 @@
+import itertools
+import logging
+import random
+import threading
+import time
+
+# load balancing policies, named like the simple policies of an Istio DestinationRule
+ROUND_ROBIN = 'ROUND_ROBIN'
+RANDOM = 'RANDOM'
+LEAST_REQUEST = 'LEAST_REQUEST'
+
+
+class Replica:
+    SMOOTHING = 0.2  # weight of a new sample in the smoothed latency
+
+    def __init__(self, address):
+        self.address = address            # string, host:port
+        self.outstanding = 0              # int, requests in flight
+        self.latency = None               # float, smoothed latency in seconds
+        self.requests = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.ejections = 0
+        self.ejected_until = 0.0          # float, monotonic time
+
+    def is_ejected(self, now):
+        return self.ejected_until > now
+
+    def stats(self, now):
+        return dict(address=self.address, outstanding=self.outstanding, latency=self.latency,
+                    requests=self.requests, failures=self.failures, ejections=self.ejections,
+                    ejected=self.is_ejected(now))
+
+
+class Balancer:
+    """
+    Client-side load balancer over the replicas of an upstream service.
+    LEAST_REQUEST picks the replica with fewer outstanding requests out of two random choices.
+    Failing replicas are passively ejected like with Istio outlier detection: a replica with
+    consecutive_errors failures in a row is ejected for base_ejection_time seconds times the number of its ejections,
+    while at most max_ejection_percent of the replicas are ejected at once.
+    """
+
+    def __init__(self, name, addresses, policy=LEAST_REQUEST, consecutive_errors=5, base_ejection_time=30,
+                 max_ejection_percent=50):
+        self.name = name                                    # string
+        self.replicas = [Replica(address) for address in addresses]
+        self.policy = policy                                # string
+        self.consecutive_errors = consecutive_errors        # int
+        self.base_ejection_time = base_ejection_time        # float, in seconds
+        self.max_ejection_percent = max_ejection_percent    # int
+        self.lock = threading.Lock()
+        self.cycle = itertools.cycle(self.replicas)
+
+    def pick(self, exclude=()):
+        """
+        Choose a replica for the next request, avoiding ejected and excluded replicas when possible.
+        """
+        with self.lock:
+            now = time.monotonic()
+            candidates = [r for r in self.replicas if not r.is_ejected(now) and r not in exclude]
+            if not candidates:
+                # panic mode: better try an ejected replica than fail the request
+                candidates = [r for r in self.replicas if r not in exclude] or self.replicas
+            if self.policy == ROUND_ROBIN:
+                replica = next(r for r in self.cycle if r in candidates)
+            elif self.policy == RANDOM:
+                replica = random.choice(candidates)
+            else:
+                # the sample is in random order, so ties go to a random replica; breaking them by latency
+                # would starve a replica that once answered slowly, as its latency is no longer updated
+                replica = min(random.sample(candidates, min(2, len(candidates))), key=lambda r: r.outstanding)
+            replica.outstanding += 1
+            replica.requests += 1
+            return replica
+
+    def has_alternative(self, exclude):
+        """
+        Tell whether a replica outside of exclude can take a request without falling back to panic mode.
+        """
+        with self.lock:
+            now = time.monotonic()
+            return any(not r.is_ejected(now) and r not in exclude for r in self.replicas)
+
+    def release(self, replica, latency, failed=False):
+        """
+        Record the latency in seconds and the outcome of a request to a replica.
+        """
+        with self.lock:
+            replica.outstanding -= 1
+            if replica.latency is None:
+                replica.latency = latency
+            else:
+                replica.latency += (latency - replica.latency) * Replica.SMOOTHING
+            if not failed:
+                replica.consecutive_failures = 0
+                return
+            replica.failures += 1
+            replica.consecutive_failures += 1
+            now = time.monotonic()
+            ejected = sum(r.is_ejected(now) for r in self.replicas)
+            if replica.consecutive_failures >= self.consecutive_errors and not replica.is_ejected(now) \
+                    and (ejected + 1) * 100 <= self.max_ejection_percent * len(self.replicas):
+                replica.ejections += 1
+                replica.ejected_until = now + self.base_ejection_time * replica.ejections
+                replica.consecutive_failures = 0
+                logging.warning(f"Ejected {replica.address} of {self.name} for "
+                                f"{self.base_ejection_time * replica.ejections} seconds")
+
+    def cancel(self, replica):
+        """
+        Release a request that never reached the replica, without recording an outcome.
+        """
+        with self.lock:
+            replica.outstanding -= 1
+
+    def stats(self):
+        with self.lock:
+            now = time.monotonic()
+            return dict(policy=self.policy, replicas=[r.stats(now) for r in self.replicas])
@@ -0,0 +1,108 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import parse_qsl
+
+
+class BufferedResponse:
+    def __init__(self, status, headers, body):
+        self.status = status      # int
+        self.headers = headers    # list of (name, value)
+        self.body = body          # bytes
+
+    def size(self):
+        return len(self.body) + sum(len(name) + len(value) for name, value in self.headers)
+
+
+def get_accept_encoding(headers):
+    """
+    Normalize the Accept-Encoding of forwarded request headers, so equivalent ones compare equal.
+    """
+    value = next((value for name, value in headers.items() if name.lower() == 'accept-encoding'), '')
+    codings = sorted({coding.replace(' ', '').lower() for coding in value.split(',') if coding.strip()})
+    return ','.join(codings) or 'identity'
+
+
+def get_cache_key(route, query_params, body, headers):
+    """
+    Identify a request by its route, query parameters, body and accepted encodings.
+    Query parameters are sorted and JSON bodies are canonicalized, so equivalent requests share a key.
+    Bodies are passed through as the upstream encoded them, so clients accepting different encodings do not.
+    """
+    query = tuple(sorted(parse_qsl(query_params, keep_blank_values=True)))
+    try:
+        body = json.dumps(json.loads(body), sort_keys=True, separators=(',', ':')).encode()
+    except ValueError:
+        pass
+    return route, query, body, get_accept_encoding(headers)
+
+
+class ResponseCache:
+    """
+    Least recently used cache of upstream responses.
+    Memory is bounded by the total size of the cached responses and entries expire after the TTL of their route.
+    """
+
+    def __init__(self, max_bytes, ttls):
+        self.max_bytes = max_bytes    # int
+        self.ttls = ttls              # dict of route -> seconds
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()  # key -> (expiry time, response)
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def is_cacheable(self, route):
+        return route in self.ttls
+
+    def remove(self, key):
+        expires, response = self.entries.pop(key)
+        self.size -= response.size() + len(key[2])
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                expires, response = entry
+                if expires > time.monotonic():
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return response
+                self.remove(key)
+                self.expirations += 1
+            self.misses += 1
+            return None
+
+    def put(self, key, response):
+        route = key[0]
+        size = response.size() + len(key[2])
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.entries:
+                self.remove(key)
+            while self.size + size > self.max_bytes:
+                self.remove(next(iter(self.entries)))
+                self.evictions += 1
+            self.entries[key] = (time.monotonic() + self.ttls[route], response)
+            self.size += size
+
+    def purge(self, route=None):
+        """
+        Remove all entries or the entries of a route.
+        """
+        with self.lock:
+            keys = [key for key in self.entries if route is None or key[0] == route]
+            for key in keys:
+                self.remove(key)
+            return len(keys)
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return dict(entries=len(self.entries), size=self.size, max_size=self.max_bytes,
+                        hits=self.hits, misses=self.misses, hit_ratio=self.hits / lookups if lookups else 0.0,
+                        evictions=self.evictions, expirations=self.expirations)
@@ -0,0 +1,115 @@
+import math
+import threading
+import time
+
+
+class Overloaded(Exception):
+    def __init__(self, upstream, retry_after):
+        super().__init__(f"{upstream} is overloaded")
+        self.upstream = upstream          # string
+        self.retry_after = retry_after    # int, in seconds
+
+
+class AdaptiveLimiter:
+    """
+    Concurrency limit of an upstream service adapted to the observed latency
+    with additive increase and multiplicative decrease (AIMD).
+    The limit grows by one per round of requests answered close to the baseline latency and
+    shrinks when a request fails or takes longer than the tolerated multiple of the baseline.
+    Baselines are kept per latency key (such as the route and model of a request), so requests that are
+    slow by nature are compared with their own kind instead of with the fastest requests of the upstream.
+    Requests over the limit wait in a bounded queue and are shed when the queue is full or the wait times out.
+    """
+
+    BASELINE_DRIFT = 0.01  # share of the gap by which the baseline latency follows slower samples
+    SMOOTHING = 0.2        # weight of a new sample in the smoothed latency
+
+    def __init__(self, name, initial_limit, min_limit, max_limit, max_queue, queue_timeout,
+                 tolerance=2.0, backoff=0.9):
+        self.name = name                      # string
+        self.limit = float(initial_limit)     # float, current concurrency limit
+        self.min_limit = min_limit            # int
+        self.max_limit = max_limit            # int
+        self.max_queue = max_queue            # int, maximum number of waiting requests
+        self.queue_timeout = queue_timeout    # float, maximum wait in seconds
+        self.tolerance = tolerance            # float, tolerated multiple of the baseline latency
+        self.backoff = backoff                # float, factor applied to the limit on congestion
+        self.condition = threading.Condition()
+        self.in_flight = 0
+        self.queued = 0
+        self.baseline_latencies = {}
+        self.smoothed_latency = None
+        self.admitted = 0
+        self.shed = 0
+
+    def retry_after(self):
+        """
+        Estimate in seconds when a shed request is likely to be admitted.
+        """
+        latency = self.smoothed_latency or 1.0
+        return max(1, math.ceil(latency * (self.queued + 1) / self.limit))
+
+    def reject(self):
+        self.shed += 1
+        raise Overloaded(self.name, self.retry_after())
+
+    def acquire(self):
+        """
+        Admit a request or raise Overloaded.
+        """
+        with self.condition:
+            if self.queued == 0 and self.in_flight < int(self.limit):
+                self.in_flight += 1
+                self.admitted += 1
+                return
+            if self.queued >= self.max_queue:
+                self.reject()
+            deadline = time.monotonic() + self.queue_timeout
+            self.queued += 1
+            try:
+                while self.in_flight >= int(self.limit):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.reject()
+                    self.condition.wait(remaining)
+            finally:
+                self.queued -= 1
+            self.in_flight += 1
+            self.admitted += 1
+
+    def release(self, latency, failed=False, key=''):
+        """
+        Release a request and adapt the limit to its latency in seconds, compared with the baseline of its key.
+        """
+        with self.condition:
+            saturated = self.in_flight >= int(self.limit)
+            self.in_flight -= 1
+            baseline_latency = self.baseline_latencies.get(key)
+            if baseline_latency is None or latency < baseline_latency:
+                baseline_latency = latency
+            else:
+                baseline_latency += (latency - baseline_latency) * self.BASELINE_DRIFT
+            self.baseline_latencies[key] = baseline_latency
+            if self.smoothed_latency is None:
+                self.smoothed_latency = latency
+            else:
+                self.smoothed_latency += (latency - self.smoothed_latency) * self.SMOOTHING
+            if failed or latency > self.tolerance * baseline_latency:
+                self.limit = max(float(self.min_limit), self.limit * self.backoff)
+            elif saturated:
+                self.limit = min(float(self.max_limit), self.limit + 1 / self.limit)
+            self.condition.notify(max(int(self.limit) - self.in_flight, 0))
+
+    def cancel(self):
+        """
+        Release a request that never reached the upstream, without adapting the limit.
+        """
+        with self.condition:
+            self.in_flight -= 1
+            self.condition.notify(max(int(self.limit) - self.in_flight, 0))
+
+    def stats(self):
+        with self.condition:
+            return dict(limit=self.limit, in_flight=self.in_flight, queued=self.queued,
+                        baseline_latencies=dict(self.baseline_latencies), smoothed_latency=self.smoothed_latency,
+                        admitted=self.admitted, shed=self.shed)
@@ -0,0 +1,168 @@
+import functools
+import logging
+import math
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3 import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import EmptyPoolError
+
+from limiter import Overloaded
+
+
+class BoundedHTTPConnectionPool(HTTPConnectionPool):
+    """
+    Connection pool that waits at most pool_timeout seconds for a free connection when it blocks.
+    requests never passes a pool timeout to urllib3, which would otherwise wait forever.
+    """
+
+    def __init__(self, *args, pool_timeout=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.pool_timeout = pool_timeout    # float, in seconds
+
+    def urlopen(self, *args, **kwargs):
+        kwargs.setdefault('pool_timeout', self.pool_timeout)
+        return super().urlopen(*args, **kwargs)
+
+
+class BoundedHTTPSConnectionPool(BoundedHTTPConnectionPool, HTTPSConnectionPool):
+    pass
+
+
+class BoundedHTTPAdapter(HTTPAdapter):
+    """
+    Transport adapter whose connection pools wait at most pool_timeout seconds for a free connection.
+    """
+
+    def __init__(self, pool_timeout, **kwargs):
+        self.pool_timeout = pool_timeout
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = dict(
+            http=functools.partial(BoundedHTTPConnectionPool, pool_timeout=self.pool_timeout),
+            https=functools.partial(BoundedHTTPSConnectionPool, pool_timeout=self.pool_timeout))
+
+
+class UpstreamPool:
+    """
+    Keep-alive connection pool to an upstream service.
+    Connections are reused across proxied requests and closed by a background thread once the upstream
+    has been idle for longer than the idle timeout. At most pool_size connections are open per host,
+    further requests wait up to the pool timeout for one to be returned and are shed with Overloaded after it.
+    Requests fail once connecting or waiting for the upstream takes longer than its timeouts.
+    Usage counters help to size the pool.
+    """
+
+    def __init__(self, name, pool_size, idle_timeout, pool_timeout, connect_timeout, read_timeout, hosts=1):
+        self.name = name                          # string
+        self.pool_size = pool_size                # int, per host
+        self.idle_timeout = idle_timeout          # float, in seconds
+        self.pool_timeout = pool_timeout          # float, in seconds
+        self.connect_timeout = connect_timeout    # float, in seconds
+        self.read_timeout = read_timeout          # float, in seconds
+        self.hosts = hosts                        # int, number of replicas
+        self.lock = threading.Lock()
+        self.session = self.create_session()
+        self.last_used = time.monotonic()
+        self.requests = 0
+        self.in_use = 0
+        self.max_in_use = 0
+        self.idle_resets = 0
+        self.closed_connections = 0
+        self.closed_requests = 0
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def create_session(self):
+        session = requests.Session()
+        adapter = BoundedHTTPAdapter(self.pool_timeout, pool_connections=self.hosts, pool_maxsize=self.pool_size,
+                                     pool_block=True)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    def count_connections(self):
+        """
+        Count the connections open, the connections opened and the requests sent by the current session.
+        The queue of a pool holds its idle connections and a None for each slot no connection was opened for,
+        the slots taken out of it are connections in use.
+        """
+        connections = opened = sent = 0
+        for adapter in set(self.session.adapters.values()):
+            pools = adapter.poolmanager.pools
+            for key in pools.keys():
+                pool = pools.get(key)
+                if pool is None or pool.pool is None:
+                    continue
+                with pool.pool.mutex:
+                    idle = sum(connection is not None for connection in pool.pool.queue)
+                    in_use = pool.pool.maxsize - len(pool.pool.queue)
+                connections += idle + in_use
+                opened += pool.num_connections
+                sent += pool.num_requests
+        return connections, opened, sent
+
+    def reset(self):
+        """
+        Close all kept-alive connections and start over with an empty pool.
+        """
+        _, opened, sent = self.count_connections()
+        self.closed_connections += opened
+        self.closed_requests += sent
+        self.session.close()
+        self.session = self.create_session()
+        self.idle_resets += 1
+        logging.debug(f"Closed idle connections to {self.name}")
+
+    def close_idle(self):
+        """
+        Close the kept-alive connections if the upstream has been idle for longer than the idle timeout.
+        """
+        with self.lock:
+            if self.in_use == 0 and time.monotonic() - self.last_used > self.idle_timeout \
+                    and self.count_connections()[0] > 0:
+                self.reset()
+
+    def run(self):
+        while True:
+            time.sleep(self.idle_timeout / 2)
+            self.close_idle()
+
+    def acquire(self):
+        with self.lock:
+            self.requests += 1
+            self.in_use += 1
+            self.max_in_use = max(self.max_in_use, self.in_use)
+            return self.session
+
+    def release(self):
+        with self.lock:
+            self.in_use -= 1
+            self.last_used = time.monotonic()
+
+    def request(self, method, url, **kwargs):
+        session = self.acquire()
+        try:
+            return session.request(method, url, timeout=(self.connect_timeout, self.read_timeout), **kwargs)
+        except EmptyPoolError:
+            raise Overloaded(self.name, max(1, math.ceil(self.pool_timeout)))
+        finally:
+            self.release()
+
+    def stats(self):
+        """
+        Provide pool usage counters. Reused connections count the requests sent over an already open connection.
+        """
+        with self.lock:
+            connections, opened, sent = self.count_connections()
+            opened += self.closed_connections
+            sent += self.closed_requests
+            return dict(pool_size=self.pool_size, idle_timeout=self.idle_timeout, pool_timeout=self.pool_timeout,
+                        connect_timeout=self.connect_timeout, read_timeout=self.read_timeout,
+                        requests=self.requests, in_use=self.in_use, max_in_use=self.max_in_use,
+                        connections_open=connections, connections_opened=opened,
+                        connections_reused=sent - opened, idle_resets=self.idle_resets)
@@ -0,0 +1,66 @@
+IOT = 'ms-iot'
+ANOMALY_DETECTION = 'ms-anomaly-detection'
+PREDICTION = 'ms-prediction'
+PREDICTION_ADVANCED = 'ms-prediction-advanced'
+ANALYTICS = 'ms-analytics'
+
+# replicas of each upstream as host:port, e.g. several processes of a CPU-heavy service on one host
+REPLICAS = {
+    IOT: ['localhost:8080'],
+    ANOMALY_DETECTION: ['localhost:8084'],
+    PREDICTION: ['localhost:8085'],
+    PREDICTION_ADVANCED: ['localhost:8086'],
+    ANALYTICS: ['localhost:8087']
+}
+
+# client-side load balancing per upstream:
+# policy - ROUND_ROBIN, RANDOM or LEAST_REQUEST (power of two choices of outstanding requests),
+#          as in the DestinationRule of istio/load-balancing.yaml
+# consecutive_errors - failures in a row after which a replica is ejected
+# base_ejection_time - seconds of the first ejection, multiplied by the number of ejections of the replica
+# max_ejection_percent - maximum share of ejected replicas
+LOAD_BALANCER_SETTINGS = {
+    IOT: dict(policy='LEAST_REQUEST', consecutive_errors=5, base_ejection_time=30, max_ejection_percent=50),
+    ANOMALY_DETECTION: dict(policy='LEAST_REQUEST', consecutive_errors=5, base_ejection_time=30,
+                            max_ejection_percent=50),
+    PREDICTION: dict(policy='LEAST_REQUEST', consecutive_errors=5, base_ejection_time=30, max_ejection_percent=50),
+    PREDICTION_ADVANCED: dict(policy='LEAST_REQUEST', consecutive_errors=5, base_ejection_time=30,
+                              max_ejection_percent=50),
+    ANALYTICS: dict(policy='LEAST_REQUEST', consecutive_errors=5, base_ejection_time=30, max_ejection_percent=50)
+}
+
+# keep-alive connection pool per upstream:
+# pool_size - maximum number of connections open to each replica, further requests wait for a free one
+# idle_timeout - seconds without any request after which kept-alive connections are closed
+# pool_timeout - seconds a request may wait for a free connection before it is shed
+# connect_timeout, read_timeout - seconds to connect to a replica and to wait for each read of its response
+POOL_SETTINGS = {
+    IOT: dict(pool_size=2, idle_timeout=600, pool_timeout=5, connect_timeout=5, read_timeout=600),
+    ANOMALY_DETECTION: dict(pool_size=20, idle_timeout=60, pool_timeout=5, connect_timeout=5, read_timeout=60),
+    PREDICTION: dict(pool_size=10, idle_timeout=60, pool_timeout=5, connect_timeout=5, read_timeout=120),
+    PREDICTION_ADVANCED: dict(pool_size=20, idle_timeout=60, pool_timeout=5, connect_timeout=5, read_timeout=300),
+    ANALYTICS: dict(pool_size=10, idle_timeout=60, pool_timeout=5, connect_timeout=5, read_timeout=30)
+}
+
+# adaptive concurrency limit per upstream:
+# initial_limit, min_limit, max_limit - bounds of the number of concurrent requests,
+#                                       max_limit at most pool_size so admitted requests never wait for a connection
+# max_queue - maximum number of requests waiting for admission
+# queue_timeout - seconds a request may wait before it is shed
+LIMITER_SETTINGS = {
+    IOT: dict(initial_limit=2, min_limit=1, max_limit=2, max_queue=2, queue_timeout=1),
+    ANOMALY_DETECTION: dict(initial_limit=10, min_limit=2, max_limit=20, max_queue=50, queue_timeout=5),
+    PREDICTION: dict(initial_limit=10, min_limit=2, max_limit=10, max_queue=50, queue_timeout=5),
+    PREDICTION_ADVANCED: dict(initial_limit=4, min_limit=1, max_limit=20, max_queue=20, queue_timeout=5),
+    ANALYTICS: dict(initial_limit=10, min_limit=4, max_limit=10, max_queue=100, queue_timeout=2)
+}
+
+# gateway routes: path -> (method, upstream, upstream path)
+ROUTES = {
+    '/api/generateSensorData': ('POST', IOT, '/v1/generateSensorData'),
+    '/api/detectAnomaly': ('POST', ANOMALY_DETECTION, '/v1/detectAnomaly'),
+    '/api/predict': ('POST', PREDICTION_ADVANCED, '/v1/predict'),
+    '/api/assessPredictions': ('POST', ANALYTICS, '/v1/assessPredictions'),
+    '/api/getAccuratePrediction': ('POST', ANALYTICS, '/v1/getAccuratePrediction'),
+    '/api/getValidPredictions': ('DELETE', ANALYTICS, '/v1/getValidPredictions')
+}
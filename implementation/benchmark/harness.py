@@ -0,0 +1,173 @@
+import argparse
+import json
+import logging
+import os
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+from store import Store, seed
+
+IMPLEMENTATION_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCHMARK_DIR = os.path.join(IMPLEMENTATION_DIR, 'benchmark')
+RUNNER_DIR = os.path.join(IMPLEMENTATION_DIR, 'runner')
+MIGRATIONS_DIR = os.path.join(IMPLEMENTATION_DIR, 'migrations')
+
+sys.path.insert(0, MIGRATIONS_DIR)
+import migrate  # noqa: E402
+
+GATEWAY = 'localhost:8090'
+
+# directory, script and port of the processes behind the gateway, in start order
+SERVICES = [
+    (BENCHMARK_DIR, 'stub_iot.py', 8080),
+    (os.path.join(IMPLEMENTATION_DIR, 'ms_anomaly_detection'), 'ms_anomaly_detection.py', 8084),
+    (os.path.join(IMPLEMENTATION_DIR, 'ms_prediction'), 'ms_prediction.py', 8085),
+    (os.path.join(IMPLEMENTATION_DIR, 'ms_prediction_advanced'), 'ms_prediction_advanced.py', 8086),
+    (os.path.join(IMPLEMENTATION_DIR, 'ms_analytics'), 'ms_analytics.py', 8087),
+    (os.path.join(IMPLEMENTATION_DIR, 'api_gateway'), 'api_gateway.py', 8090),
+]
+
+START_TIMEOUT = 120  # in seconds, the prediction services import Prophet and darts
+MAX_REGRESSION = 0.2  # tolerated relative increase of the p99 or decrease of the throughput
+
+
+def is_listening(port):
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        return sock.connect_ex(('localhost', port)) == 0
+
+
+def wait_for_port(port, process, timeout=START_TIMEOUT):
+    deadline = time.monotonic() + timeout
+    while not is_listening(port):
+        if process.poll() is not None:
+            raise RuntimeError(f"Process on port {port} exited with {process.returncode}")
+        if time.monotonic() > deadline:
+            raise RuntimeError(f"Nothing listens on port {port} after {timeout} seconds")
+        time.sleep(0.2)
+
+
+def start_services(log_dir, services=SERVICES):
+    """
+    Start the services in their own process groups, so the Flask reloaders stop with them.
+    """
+    processes = []
+    try:
+        for directory, script, port in services:
+            if is_listening(port):
+                raise RuntimeError(f"Port {port} for {script} is already in use")
+            log_file = open(os.path.join(log_dir, script.replace('.py', '.log')), 'w')
+            process = subprocess.Popen([sys.executable, script], cwd=directory, stdout=log_file,
+                                       stderr=subprocess.STDOUT, start_new_session=True)
+            processes.append(process)
+            wait_for_port(port, process)
+            logging.info(f"Started {script} on port {port}")
+    except Exception:
+        stop_services(processes)
+        raise
+    return processes
+
+
+def stop_services(processes):
+    for process in reversed(processes):
+        if process.poll() is None:
+            os.killpg(process.pid, signal.SIGTERM)
+    for process in processes:
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            os.killpg(process.pid, signal.SIGKILL)
+
+
+def run_runner(runner_args, report_path):
+    """
+    Drive the services through the gateway with a runner scenario and provide its report.
+    Simulated users, open-loop rates, compiled workloads and replayed logs all go to the gateway.
+    """
+    command = [sys.executable, 'runner_async.py', '--gateway', GATEWAY, '--target', f"http://{GATEWAY}",
+               '--report', report_path] + runner_args
+    logging.info(f"Running {' '.join(command[1:])}")
+    subprocess.run(command, cwd=RUNNER_DIR, check=True)
+    with open(report_path) as file:
+        return json.load(file)
+
+
+def compare_reports(report, baseline, max_regression=MAX_REGRESSION):
+    """
+    Find endpoints whose p99 response time grew or whose throughput dropped by more than max_regression.
+    """
+    endpoints = {(endpoint['endpoint'], endpoint['model']): endpoint for endpoint in report['endpoints']}
+    regressions = []
+    for expected in baseline['endpoints']:
+        key = (expected['endpoint'], expected['model'])
+        actual = endpoints.get(key)
+        if actual is None:
+            regressions.append(f"{' '.join(key).strip()}: missing")
+            continue
+        p99, expected_p99 = actual['response_time']['p99'], expected['response_time']['p99']
+        if p99 > expected_p99 * (1 + max_regression):
+            regressions.append(f"{' '.join(key).strip()}: p99 {p99:.1f} ms instead of {expected_p99:.1f} ms")
+        throughput, expected_throughput = actual['throughput'] or 0, expected['throughput'] or 0
+        if throughput < expected_throughput * (1 - max_regression):
+            regressions.append(f"{' '.join(key).strip()}: throughput {throughput:.1f}/s "
+                               f"instead of {expected_throughput:.1f}/s")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the Python services end to end with a seeded store and a stub IoT service. "
+                    "Arguments after -- are passed to runner_async.py, e.g. -- --rate 20 --duration 60")
+    parser.add_argument('--directory', help="run directory for the store, logs and report, temporary by default")
+    parser.add_argument('--pg-bin', help="directory of initdb and pg_ctl, if not on the PATH")
+    parser.add_argument('--external-store', action='store_true',
+                        help="use the PostgreSQL already running on localhost instead of a throwaway cluster")
+    parser.add_argument('--reseed', action='store_true',
+                        help="replace the aggregated_data of an external store with the seeded series, "
+                             "otherwise its data is kept")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--baseline', help="report of an earlier run to compare with")
+    parser.add_argument('--max-regression', type=float, default=MAX_REGRESSION)
+    parser.add_argument('--save-baseline', help="file to copy the report of this run to")
+    parser.add_argument('runner_args', nargs=argparse.REMAINDER)
+    args = parser.parse_args()
+    runner_args = args.runner_args[1:] if args.runner_args[:1] == ['--'] else args.runner_args
+
+    directory = args.directory or tempfile.mkdtemp(prefix='benchmark-')
+    os.makedirs(directory, exist_ok=True)
+    store = Store(directory, bin_dir=args.pg_bin)
+    processes = []
+    try:
+        if not args.external_store:
+            store.start()
+        conn = store.connect()
+        # seeding empties aggregated_data, which an external store may hold real data in
+        if not args.external_store or args.reseed:
+            seed(conn, args.seed)
+        migrate.migrate(conn)
+        conn.close()
+        processes = start_services(directory)
+        report = run_runner(runner_args, os.path.join(directory, 'report.json'))
+    finally:
+        stop_services(processes)
+        if not args.external_store:
+            store.stop()
+    logging.info(f"Logs and report are in {directory}")
+    if args.save_baseline:
+        shutil.copyfile(os.path.join(directory, 'report.json'), args.save_baseline)
+    if args.baseline:
+        with open(args.baseline) as file:
+            regressions = compare_reports(report, json.load(file), args.max_regression)
+        for regression in regressions:
+            logging.error(f"Regression of {regression}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    logging.getLogger().setLevel(logging.INFO)
+    main()
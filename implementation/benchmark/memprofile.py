@@ -0,0 +1,239 @@
+import argparse
+import datetime
+import gc
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+import tracemalloc
+
+import pandas as pd
+
+from harness import SERVICES, migrate, start_services, stop_services
+from microbench import DAY, get_series, load_services
+from store import Store, seed
+
+PREDICTION_MODELS = {
+    'ms_prediction': [None],
+    'ms_prediction_advanced': [None, 'ExponentialSmoothing', 'Prophet'],
+}
+DATA_TYPES = ['TEMPERATURE', 'PRESSURE']    # monthly and daily series of the seeded store
+ACCURACIES = ['LOW', 'HIGH']
+FIRST_DATE = datetime.date(1971, 1, 1)      # first date of the seeded store
+
+REPEAT = 3
+TOP = 10                    # allocation sites per case
+FRAMES = 1                  # frames per allocation site
+SAMPLE_INTERVAL = 0.005     # in seconds, between checks for a new peak of the sampled run
+SAMPLE_GROWTH = 0.1         # relative growth of the traced memory that takes a new snapshot
+HEADROOM = 0.5              # added to the largest peak of an endpoint for its budget
+
+
+class Case:
+    def __init__(self, service, method, path, label, query=None, body=None):
+        self.service = service      # string, e.g. ms_prediction_advanced
+        self.method = method        # string
+        self.path = path            # string, e.g. /v1/predict
+        self.label = label          # string, e.g. TEMPERATURE HIGH
+        self.query = query or {}    # dict
+        self.body = body            # JSON serializable, the request body
+
+    def get_endpoint(self):
+        query = '&'.join(f"{key}={value}" for key, value in self.query.items())
+        return f"{self.service} {self.method} {self.path}{'?' + query if query else ''}"
+
+
+class PeakSampler(threading.Thread):
+    """
+    Snapshot the traced allocations whenever they grew notably, to find the allocation sites at the peak.
+    The snapshots themselves are traced, so a sampled run does not measure the peak.
+    """
+
+    def __init__(self):
+        super().__init__(daemon=True)
+        self.peak = 0               # int, traced bytes at the snapshot
+        self.snapshot = None        # tracemalloc.Snapshot
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(SAMPLE_INTERVAL):
+            self.sample()
+
+    def sample(self):
+        current, _ = tracemalloc.get_traced_memory()
+        if current > self.peak * (1 + SAMPLE_GROWTH):
+            self.snapshot = tracemalloc.take_snapshot()
+            self.peak = current
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+        self.sample()
+
+
+def get_cases(today):
+    """
+    Define requests with the series lengths of the seeded store: LOW accuracy extracts two years of values,
+    HIGH accuracy every value since 1971.
+    """
+    date = datetime.datetime.strftime(today, "%Y-%m-%d")
+    cases = []
+    for service, models in PREDICTION_MODELS.items():
+        for model in models:
+            query = dict(predictionModel=model) if model else None
+            for data_type in DATA_TYPES:
+                for accuracy in ACCURACIES:
+                    cases.append(Case(service, 'POST', '/v1/predict', f"{data_type} {accuracy}", query,
+                                      dict(type=data_type, date=date, accuracy=accuracy)))
+    for data_type in DATA_TYPES:
+        cases.append(Case('ms_anomaly_detection', 'POST', '/v1/detectAnomaly', data_type, body=dict(type=data_type)))
+        cases.append(Case('ms_anomaly_detection', 'POST', '/v1/detectAnomaly', data_type, dict(thresholds=True),
+                          dict(type=data_type, start_date=datetime.datetime.strftime(FIRST_DATE, "%Y-%m-%d"),
+                               end_date=date, low_value=-10, high_value=30)))
+    # a daily series sent like clean_anomaly of the predictions sends it
+    df = get_series(DAY, (today - FIRST_DATE).days)
+    df['timestamp'] = pd.to_datetime(df['timestamp'], format="%Y-%m-%d")
+    df.set_index('timestamp', inplace=True)
+    cases.append(Case('ms_anomaly_detection', 'DELETE', '/v1/cleanAnomaly', f"{df.shape[0]} days",
+                      body=df.to_json(orient='index')))
+    # the true values of the predictions are the last values of the seeded series
+    last_dates = dict(TEMPERATURE=today.replace(day=1) - datetime.timedelta(days=1),
+                      PRESSURE=today - datetime.timedelta(days=1))
+    intervals = dict(TEMPERATURE='MONTH', PRESSURE='DAY')
+    for data_type in DATA_TYPES:
+        predictions = [dict(date=datetime.datetime.strftime(last_dates[data_type], "%Y-%m-%d"),
+                            aggregation_mode='AVG', aggregation_interval=intervals[data_type],
+                            data_type=data_type, predicted_value=value) for value in (10.0, 12.5, 15.0)]
+        for method, path in [('POST', '/v1/assessPredictions'), ('POST', '/v1/getAccuratePrediction'),
+                             ('DELETE', '/v1/getValidPredictions')]:
+            cases.append(Case('ms_analytics', method, path, data_type, body=dict(predictions=predictions)))
+    return cases
+
+
+def send(client, case):
+    return client.open(case.path, method=case.method, query_string=case.query, json=case.body)
+
+
+def get_top_sites(snapshot, top=TOP):
+    snapshot = snapshot.filter_traces([tracemalloc.Filter(False, tracemalloc.__file__),
+                                       tracemalloc.Filter(False, threading.__file__)])
+    statistics = snapshot.statistics('lineno')
+    sites = [dict(site=str(statistic.traceback), size=statistic.size, count=statistic.count)
+             for statistic in statistics[:top]]
+    return sites, sum(statistic.count for statistic in statistics)
+
+
+def profile(client, case, repeat=REPEAT, top=TOP):
+    """
+    Send a request once to warm up, repeat times to measure the peak and the memory retained after the response,
+    and once more with a sampler for the allocation sites and blocks near the peak.
+    """
+    response = send(client, case)
+    if response.status_code != 200:
+        logging.error(f"{case.get_endpoint()} {case.label} answered {response.status_code}")
+        return None
+    result = dict(endpoint=case.get_endpoint(), case=case.label, time=None, peak=0, retained=0)
+    for _ in range(repeat):
+        gc.collect()
+        tracemalloc.start(FRAMES)
+        start = time.perf_counter()
+        send(client, case)
+        elapsed = time.perf_counter() - start
+        retained, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        result['time'] = elapsed if result['time'] is None else min(result['time'], elapsed)
+        result['peak'] = max(result['peak'], peak)
+        result['retained'] = max(result['retained'], retained)
+    gc.collect()
+    tracemalloc.start(FRAMES)
+    sampler = PeakSampler()
+    sampler.start()
+    send(client, case)
+    sampler.stop()
+    tracemalloc.stop()
+    result['top'], result['blocks'] = get_top_sites(sampler.snapshot, top)
+    return result
+
+
+def get_budgets(results):
+    """
+    Budget the memory of a request per endpoint: its largest peak with headroom. A pod needs its idle memory
+    plus the budget for every request it serves concurrently.
+    """
+    budgets = {}
+    for result in results:
+        budgets[result['endpoint']] = max(budgets.get(result['endpoint'], 0), result['peak'])
+    return {endpoint: dict(peak=peak, budget=int(peak * (1 + HEADROOM))) for endpoint, peak in budgets.items()}
+
+
+def print_report(results, budgets):
+    for result in results:
+        print(f"{result['endpoint']} {result['case']}: {result['time'] * 1000:.1f} ms, "
+              f"peak {result['peak'] / 2 ** 20:.2f} MiB, retained {result['retained'] / 2 ** 20:.2f} MiB, "
+              f"{result['blocks']} blocks near the peak")
+        for site in result['top']:
+            print(f"    {site['size'] / 2 ** 20:8.2f} MiB {site['count']:8} blocks  {site['site']}")
+    print()
+    print(f"{'endpoint':80} {'peak MiB':>10} {'budget MiB':>10}")
+    for endpoint, budget in budgets.items():
+        print(f"{endpoint:80} {budget['peak'] / 2 ** 20:10.2f} {budget['budget'] / 2 ** 20:10.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Profile the memory of every endpoint per request with tracemalloc, against a seeded store.")
+    parser.add_argument('--directory', help="run directory for the store and logs, temporary by default")
+    parser.add_argument('--pg-bin', help="directory of initdb and pg_ctl, if not on the PATH")
+    parser.add_argument('--external-store', action='store_true',
+                        help="use the PostgreSQL already running on localhost instead of a throwaway cluster")
+    parser.add_argument('--reseed', action='store_true',
+                        help="replace the aggregated_data of an external store with the seeded series, "
+                             "otherwise its data is kept")
+    parser.add_argument('--endpoint', action='append',
+                        help="profile only endpoints containing this text, e.g. Prophet, can be repeated")
+    parser.add_argument('--repeat', type=int, default=REPEAT)
+    parser.add_argument('--top', type=int, default=TOP, help="allocation sites per case")
+    parser.add_argument('--output', help="JSON file to write the results and budgets to")
+    args = parser.parse_args()
+
+    today = datetime.date.today()
+    cases = get_cases(today)
+    if args.endpoint:
+        cases = [case for case in cases if any(text in case.get_endpoint() for text in args.endpoint)]
+    directory = args.directory or tempfile.mkdtemp(prefix='memprofile-')
+    os.makedirs(directory, exist_ok=True)
+    store = Store(directory, bin_dir=args.pg_bin)
+    processes = []
+    try:
+        if not args.external_store:
+            store.start()
+        conn = store.connect()
+        # seeding empties aggregated_data, which an external store may hold real data in
+        if not args.external_store or args.reseed:
+            seed(conn, end=today)
+        migrate.migrate(conn)
+        conn.close()
+        # the predictions clean their series with a separate anomaly detection, like in a deployment
+        processes = start_services(directory, [service for service in SERVICES
+                                               if service[1] == 'ms_anomaly_detection.py'])
+        clients = {name: module.app.test_client() for name, module in load_services().items()}
+        results = []
+        for case in cases:
+            result = profile(clients[case.service], case, args.repeat, args.top)
+            if result is not None:
+                results.append(result)
+    finally:
+        stop_services(processes)
+        if not args.external_store:
+            store.stop()
+    budgets = get_budgets(results)
+    print_report(results, budgets)
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(dict(results=results, budgets=budgets), file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,273 @@
+import argparse
+import datetime
+import gc
+import importlib
+import json
+import logging
+import os
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+IMPLEMENTATION_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SERVICES = ['ms_anomaly_detection', 'ms_prediction', 'ms_prediction_advanced', 'ms_analytics']
+
+YEAR = 'YEAR'
+MONTH = 'MONTH'
+DAY = 'DAY'
+INTERVALS = [YEAR, MONTH, DAY]
+
+SIZES = [100, 1000, 10000, 100000]
+REPEAT = 3
+
+END_DATE = datetime.date(2020, 12, 31)  # last date of the synthetic series
+# the services parse timestamps to datetime64[ns], so series cannot start before its minimum
+MIN_DATE = np.datetime64(pd.Timestamp.min, 'D') + 1
+OUTLIER_PROBABILITY = 0.01
+TRUE_VALUE = -20.0  # of the predictions to assess
+
+MAX_TIME_REGRESSION = 0.2       # tolerated relative increase of the time
+MAX_MEMORY_REGRESSION = 0.1     # tolerated relative increase of the peak memory
+MIN_TIME_DIFFERENCE = 0.001     # in seconds, smaller differences are timer noise
+
+
+class Benchmark:
+    def __init__(self, name, setup, run):
+        self.name = name        # string, e.g. ms_prediction.preprocess
+        self.setup = setup      # function of interval and size, returning the arguments of run, not measured
+        self.run = run          # function, measured
+
+
+def load_services():
+    """
+    Import the services from their directories, the way they run in their containers.
+    """
+    for service in SERVICES:
+        sys.path.insert(0, os.path.join(IMPLEMENTATION_DIR, service))
+    return {service: importlib.import_module(service) for service in SERVICES}
+
+
+def get_dates(aggregation_interval, size):
+    """
+    Provide size dates ending on END_DATE: days, last days of months or last days of years.
+    Return None if the series would start before the services can parse its timestamps.
+    """
+    end = np.datetime64(END_DATE, 'D')
+    if aggregation_interval == DAY:
+        dates = np.arange(end - size + 1, end + 1, dtype='datetime64[D]')
+    else:
+        unit = 'Y' if aggregation_interval == YEAR else 'M'
+        last = end.astype(f'datetime64[{unit}]')
+        periods = np.arange(last - size + 1, last + 1, dtype=f'datetime64[{unit}]')
+        dates = (periods + 1).astype('datetime64[M]').astype('datetime64[D]') - 1
+    if dates[0] < MIN_DATE:
+        return None
+    return dates
+
+
+def get_series(aggregation_interval, size, seed=0):
+    """
+    Simulate a seasonal series with noise and outliers, in the columns the services extract from a database.
+    """
+    dates = get_dates(aggregation_interval, size)
+    if dates is None:
+        return None
+    rng = np.random.default_rng(seed)
+    period = {DAY: 365.25, MONTH: 12, YEAR: 1}[aggregation_interval]
+    values = 10 + 12 * np.sin(2 * np.pi * np.arange(size) / period) + rng.normal(0, 2, size)
+    outliers = rng.random(size) < OUTLIER_PROBABILITY
+    values[outliers] += rng.choice([-25, 25], outliers.sum())
+    return pd.DataFrame({'data_value': values, 'timestamp': dates.astype('datetime64[ns]')})
+
+
+def get_end_date(aggregation_interval):
+    """
+    Provide a prediction end date some missing values after END_DATE.
+    """
+    if aggregation_interval == DAY:
+        return END_DATE + datetime.timedelta(days=3)
+    return END_DATE.replace(year=END_DATE.year + 1)
+
+
+def get_predictions(analytics, aggregation_interval, size, seed=0):
+    rng = np.random.default_rng(seed)
+    date = datetime.datetime.strftime(END_DATE, "%Y-%m-%d")
+    return [analytics.Prediction(dict(date=date, aggregation_mode='AVG', aggregation_interval=aggregation_interval,
+                                      data_type='TEMPERATURE', predicted_value=float(value)))
+            for value in rng.normal(TRUE_VALUE, 10, size)]
+
+
+def round_trip_clean_anomaly(client, df):
+    """
+    Send a series to the cleanAnomaly view and parse the cleaned series like clean_anomaly of the predictions.
+    """
+    json_request = df.to_json(orient='index')
+    response = client.delete('/v1/cleanAnomaly', json=json_request)
+    df = pd.read_json(response.get_json(), orient='index')
+    df.sort_index(inplace=True)
+    df.rename_axis('timestamp', inplace=True)
+    return df
+
+
+def detect_with_esd(anomaly_detection, df):
+    """
+    Detect anomalies like detect() of ms_anomaly_detection.
+    """
+    esd_ad = anomaly_detection.GeneralizedESDTestAD()
+    df_anomaly = esd_ad.fit_detect(df)
+    return df.loc[df_anomaly['data_value'] == True]
+
+
+def get_benchmarks(services):
+    anomaly_detection = services['ms_anomaly_detection']
+    prediction = services['ms_prediction']
+    advanced = services['ms_prediction_advanced']
+    analytics = services['ms_analytics']
+    client = anomaly_detection.app.test_client()
+
+    def get_series_args(interval, size):
+        df = get_series(interval, size)
+        return None if df is None else (df,)
+
+    def get_preprocessed_args(preprocess):
+        def setup(interval, size):
+            df = get_series(interval, size)
+            return None if df is None else (preprocess(df), get_end_date(interval), interval)
+        return setup
+
+    def get_true_value_args(interval, size):
+        return TRUE_VALUE, get_predictions(analytics, interval, size)
+
+    def get_thresholds_args(interval, size):
+        predictions = get_predictions(analytics, interval, size)
+        date = datetime.datetime.strptime(predictions[0].date, "%Y-%m-%d").date()
+        return predictions, analytics.get_thresholds(date, 'AVG', interval, 'TEMPERATURE')
+
+    def get_anomaly_args(interval, size):
+        df = get_series(interval, size)
+        return None if df is None else (anomaly_detection, anomaly_detection.preprocess(df))
+
+    def get_clean_anomaly_args(interval, size):
+        df = get_series(interval, size)
+        return None if df is None else (client, prediction.preprocess(df))
+
+    return [
+        Benchmark('ms_prediction.preprocess', get_series_args, prediction.preprocess),
+        Benchmark('ms_prediction.predict_missing_values', get_preprocessed_args(prediction.preprocess),
+                  prediction.predict_missing_values),
+        Benchmark('ms_prediction_advanced.preprocess', get_series_args, advanced.preprocess),
+        Benchmark('ms_prediction_advanced.preprocess[TimeSeries]', get_series_args,
+                  lambda df: advanced.preprocess(df, transform='TimeSeries')),
+        Benchmark('ms_prediction_advanced.preprocess[ProphetDataFrame]', get_series_args,
+                  lambda df: advanced.preprocess(df, transform='ProphetDataFrame')),
+        Benchmark('ms_prediction_advanced.predict_missing_values', get_preprocessed_args(advanced.preprocess),
+                  advanced.predict_missing_values),
+        Benchmark('ms_anomaly_detection.GeneralizedESDTestAD', get_anomaly_args, detect_with_esd),
+        Benchmark('ms_anomaly_detection.clean_anomaly', get_clean_anomaly_args, round_trip_clean_anomaly),
+        Benchmark('ms_analytics.estimate_errors', get_true_value_args, analytics.estimate_errors),
+        Benchmark('ms_analytics.check_predictions', get_thresholds_args, analytics.check_predictions),
+    ]
+
+
+def measure(benchmark, interval, size, repeat=REPEAT):
+    """
+    Measure the best time of repeat runs, and the peak memory traced during one more run.
+    Every run gets fresh arguments, since the services modify their data frames in place.
+    """
+    best_time = None
+    for _ in range(repeat):
+        args = benchmark.setup(interval, size)
+        if args is None:
+            return None
+        gc.collect()
+        start = time.perf_counter()
+        benchmark.run(*args)
+        elapsed = time.perf_counter() - start
+        best_time = elapsed if best_time is None else min(best_time, elapsed)
+    args = benchmark.setup(interval, size)
+    gc.collect()
+    tracemalloc.start()
+    benchmark.run(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return dict(time=best_time, peak=peak)
+
+
+def run(benchmarks, intervals=INTERVALS, sizes=SIZES, repeat=REPEAT):
+    """
+    Measure every benchmark for every interval and size, and print a table. The table is printed rather than
+    logged, so the logging of the services stays at its default level and does not flood it.
+    """
+    results = {}
+    for benchmark in benchmarks:
+        for interval in intervals:
+            for size in sizes:
+                result = measure(benchmark, interval, size, repeat)
+                if result is None:
+                    print(f"{benchmark.name:52} {interval:5} {size:>8}  skipped, starts before {MIN_DATE}")
+                    continue
+                print(f"{benchmark.name:52} {interval:5} {size:>8}  {result['time'] * 1000:10.2f} ms "
+                      f"{result['peak'] / 2 ** 20:10.2f} MiB")
+                results[f"{benchmark.name}/{interval}/{size}"] = result
+    return results
+
+
+def compare_results(results, baseline, max_time_regression=MAX_TIME_REGRESSION,
+                    max_memory_regression=MAX_MEMORY_REGRESSION):
+    """
+    Find the benchmarks whose time or peak memory grew by more than the tolerated regressions.
+    """
+    regressions = []
+    for key, expected in baseline.items():
+        actual = results.get(key)
+        if actual is None:
+            continue
+        if actual['time'] > expected['time'] * (1 + max_time_regression) \
+                and actual['time'] - expected['time'] > MIN_TIME_DIFFERENCE:
+            regressions.append(f"{key}: {actual['time'] * 1000:.2f} ms instead of {expected['time'] * 1000:.2f} ms")
+        if actual['peak'] > expected['peak'] * (1 + max_memory_regression):
+            regressions.append(f"{key}: peak {actual['peak'] / 2 ** 20:.2f} MiB "
+                               f"instead of {expected['peak'] / 2 ** 20:.2f} MiB")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the hot functions of the services on synthetic series of every aggregation interval.")
+    parser.add_argument('--benchmark', action='append',
+                        help="run only benchmarks whose name contains this text, can be repeated")
+    parser.add_argument('--interval', action='append', choices=INTERVALS, help="can be repeated, all by default")
+    parser.add_argument('--size', action='append', type=int, help="series length, can be repeated, "
+                                                                  f"{', '.join(map(str, SIZES))} by default")
+    parser.add_argument('--repeat', type=int, default=REPEAT)
+    parser.add_argument('--output', help="JSON file to write the results to")
+    parser.add_argument('--baseline', help="results of an earlier run to compare with")
+    parser.add_argument('--save-baseline', help="JSON file to store the results as a baseline")
+    parser.add_argument('--max-time-regression', type=float, default=MAX_TIME_REGRESSION)
+    parser.add_argument('--max-memory-regression', type=float, default=MAX_MEMORY_REGRESSION)
+    args = parser.parse_args()
+
+    benchmarks = get_benchmarks(load_services())
+    if args.benchmark:
+        benchmarks = [benchmark for benchmark in benchmarks
+                      if any(text in benchmark.name for text in args.benchmark)]
+    results = run(benchmarks, args.interval or INTERVALS, args.size or SIZES, args.repeat)
+    for path in (args.output, args.save_baseline):
+        if path:
+            with open(path, 'w') as file:
+                json.dump(results, file, indent=2, sort_keys=True)
+    if args.baseline:
+        with open(args.baseline) as file:
+            regressions = compare_results(results, json.load(file), args.max_time_regression,
+                                          args.max_memory_regression)
+        for regression in regressions:
+            logging.error(f"Regression of {regression}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
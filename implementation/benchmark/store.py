@@ -0,0 +1,113 @@
+import io
+import logging
+import math
+import os
+import random
+import shutil
+import subprocess
+from datetime import date, timedelta
+
+import psycopg2
+
+PORT = 5432  # the services connect to the default port
+
+TABLE = 'aggregated_data'
+
+# series written by the two ms_fog instances of the default deployment
+SERIES = [('TEMPERATURE', 'AVG', 'MONTH'), ('PRESSURE', 'AVG', 'DAY')]
+
+OUTLIER_PROBABILITY = 0.01  # share of values the anomaly detection should find
+
+
+class Store:
+    """
+    Throwaway PostgreSQL cluster in a directory, with the aggregated_data table of ms_fog.
+    """
+
+    def __init__(self, directory, port=PORT, bin_dir=None):
+        self.directory = directory          # string
+        self.port = port                    # int
+        self.bin_dir = bin_dir              # string, directory of initdb and pg_ctl, None to use the PATH
+        self.data_dir = os.path.join(directory, 'data')
+        self.log_file = os.path.join(directory, 'postgres.log')
+
+    def get_command(self, name):
+        return os.path.join(self.bin_dir, name) if self.bin_dir else shutil.which(name) or name
+
+    def start(self):
+        """
+        Initialize the cluster with trusted local connections and start it.
+        """
+        if not os.path.exists(self.data_dir):
+            subprocess.run([self.get_command('initdb'), '-D', self.data_dir, '-U', 'postgres', '-A', 'trust'],
+                           check=True, stdout=subprocess.DEVNULL)
+        subprocess.run([self.get_command('pg_ctl'), '-D', self.data_dir, '-l', self.log_file, '-w',
+                        '-o', f"-p {self.port} -k {self.directory} -c listen_addresses=localhost", 'start'],
+                       check=True, stdout=subprocess.DEVNULL)
+        logging.info(f"Started PostgreSQL on port {self.port}")
+
+    def stop(self):
+        subprocess.run([self.get_command('pg_ctl'), '-D', self.data_dir, '-m', 'fast', '-w', 'stop'],
+                       check=False, stdout=subprocess.DEVNULL)
+
+    def connect(self):
+        return psycopg2.connect(host='localhost', port=self.port, database='postgres', user='postgres',
+                                password='password')
+
+
+def get_timestamps(aggregation_interval, start, end):
+    """
+    Generate the dates of aggregated values: every day, the last day of every month or of every year.
+    """
+    day = start
+    while day <= end:
+        next_day = day + timedelta(days=1)
+        if aggregation_interval == 'DAY' \
+                or (aggregation_interval == 'MONTH' and next_day.month != day.month) \
+                or (aggregation_interval == 'YEAR' and next_day.year != day.year):
+            yield day
+        day = next_day
+
+
+def get_value(data_type, day, rng):
+    """
+    Simulate a seasonal sensor value with noise and occasional outliers.
+    """
+    season = math.sin(2 * math.pi * (day.timetuple().tm_yday - 110) / 365.25)
+    if data_type == 'TEMPERATURE':
+        value = 10 + 12 * season + rng.gauss(0, 2)
+        outlier = 25
+    else:
+        value = 1013 - 4 * season + rng.gauss(0, 3)
+        outlier = 30
+    if rng.random() < OUTLIER_PROBABILITY:
+        value += rng.choice((-1, 1)) * outlier
+    return value
+
+
+def seed(conn, seed_value=0, start=date(1971, 1, 1), end=None, series=SERIES):
+    """
+    Create the aggregated_data table like ms_fog does and fill it with deterministic series up to end.
+    An existing table is emptied rather than dropped, so its migrated indexes stay.
+    """
+    end = end or date.today()
+    rng = random.Random(seed_value)
+    cur = conn.cursor()
+    cur.execute(f"CREATE TABLE IF NOT EXISTS {TABLE} (id bigint PRIMARY KEY, data_type varchar(255),"
+                f" aggregation_mode varchar(255), aggregation_interval varchar(255),"
+                f" timestamp date, data_value double precision)")
+    cur.execute(f"TRUNCATE {TABLE}")
+    rows = io.StringIO()
+    row_id = 0
+    for data_type, aggregation_mode, aggregation_interval in series:
+        for day in get_timestamps(aggregation_interval, start, end):
+            row_id += 1
+            rows.write(f"{row_id}\t{data_type}\t{aggregation_mode}\t{aggregation_interval}\t{day.isoformat()}"
+                       f"\t{get_value(data_type, day, rng)!r}\n")
+    rows.seek(0)
+    cur.copy_expert(f"COPY {TABLE} FROM STDIN", rows)
+    cur.execute(f"ANALYZE {TABLE}")
+    conn.commit()
+    cur.close()
+    logging.info(f"Seeded {row_id} rows of {TABLE} up to {end}")
+    return row_id
@@ -0,0 +1,28 @@
+import logging
+
+from flask import Flask, request
+from flask import jsonify, make_response
+
+app = Flask(__name__)
+PORT = 8080
+
+
+@app.route('/v1/generateSensorData', methods=['POST'])
+def generate_sensor_data():
+    """
+    Stand in for ms_iot: accept a data generation request and answer like ms_iot at once,
+    since the benchmark store is already seeded.
+
+    :return: the status "OK" and a 200 OK response
+    """
+    json = request.get_json()
+    logging.info(f"* Sensor ID: {json.get('id')}. Sensor type: {json.get('type')}. "
+                 f"Request duration: {request.args.get('requestDuration')}")
+    response = make_response(jsonify(dict(error='', errorMsg='', status='OK')), 200)
+    response.headers['Content-Type'] = "application/json"
+    return response
+
+
+if __name__ == '__main__':
+    logging.getLogger().setLevel(logging.INFO)
+    app.run(host='0.0.0.0', port=PORT, threaded=True)
@@ -5,6 +5,8 @@ import java.time.LocalDate;
 
 /**
  * Aggregated sensor data saved to database.
+ * The table is created by Hibernate, its indexes for the series queries of the Python services
+ * by implementation/migrations/migrate.py (the migrations job in kubernetes/jobs).
  */
 @Entity
 @Table(name = "aggregated_data")
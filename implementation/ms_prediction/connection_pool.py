@@ -0,0 +1,165 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+MAX_SIZE = 10           # connections per service process
+TIMEOUT = 10            # in seconds, to wait for a free connection
+CHECK_INTERVAL = 30     # in seconds, idle connections are checked before reuse
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class ConnectionPool:
+    """
+    Thread-safe pool of database connections shared by the request threads of a service.
+    The pool opens at most max_size connections, lets requests wait up to timeout seconds for a free one,
+    and checks connections which have been idle for a while before handing them out again.
+    A connection is rolled back when it is returned, and closed instead if it is broken.
+    """
+
+    def __init__(self, connect, max_size=MAX_SIZE, timeout=TIMEOUT, check_interval=CHECK_INTERVAL):
+        self.connect = connect                  # function, creates a new connection
+        self.max_size = max_size                # int
+        self.timeout = timeout                  # float, in seconds
+        self.check_interval = check_interval    # float, in seconds
+        self.condition = threading.Condition()
+        self.idle = []                          # list of (connection, time of return), the latest last
+        self.size = 0
+        self.requests = 0
+        self.in_use = 0
+        self.max_in_use = 0
+        self.waits = 0
+        self.wait_time = 0.0
+        self.max_wait_time = 0.0
+        self.timeouts = 0
+        self.opened = 0
+        self.closed = 0
+        self.failed_checks = 0
+
+    def is_healthy(self, conn, returned):
+        if conn.closed:
+            return False
+        if time.monotonic() - returned < self.check_interval:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except Exception as err:
+            logging.warning(f"Idle database connection failed its check: {err}")
+            return False
+
+    def discard(self, conn):
+        """
+        Close a connection and free its place in the pool.
+        """
+        try:
+            conn.close()
+        except Exception as err:
+            logging.debug(err)
+        with self.condition:
+            self.size -= 1
+            self.closed += 1
+            self.condition.notify()
+
+    def open(self):
+        try:
+            conn = self.connect()
+        except Exception:
+            with self.condition:
+                self.size -= 1
+                self.condition.notify()
+            raise
+        with self.condition:
+            self.opened += 1
+        return conn
+
+    def acquire(self):
+        """
+        Take an idle connection, open a new one below max_size, or wait for one to be returned.
+        """
+        start = time.monotonic()
+        with self.condition:
+            self.requests += 1
+            waited = False
+            while not self.idle and self.size >= self.max_size:
+                remaining = self.timeout - (time.monotonic() - start)
+                if remaining <= 0:
+                    self.timeouts += 1
+                    raise PoolTimeout(f"No database connection free after {self.timeout} seconds")
+                waited = True
+                self.condition.wait(remaining)
+            if self.idle:
+                conn, returned = self.idle.pop()
+            else:
+                conn, returned = None, None
+                self.size += 1
+            self.in_use += 1
+            self.max_in_use = max(self.max_in_use, self.in_use)
+            wait_time = time.monotonic() - start
+            if waited:
+                self.waits += 1
+            self.wait_time += wait_time
+            self.max_wait_time = max(self.max_wait_time, wait_time)
+        try:
+            if conn is not None and not self.is_healthy(conn, returned):
+                # replace the connection, keeping its place in the pool
+                with self.condition:
+                    self.failed_checks += 1
+                    self.closed += 1
+                conn.close()
+                conn = None
+            if conn is None:
+                conn = self.open()
+        except Exception:
+            with self.condition:
+                self.in_use -= 1
+            raise
+        return conn
+
+    def release(self, conn):
+        """
+        Return a connection without an open transaction, or close it if it is broken.
+        """
+        try:
+            if not conn.closed:
+                conn.rollback()
+        except Exception as err:
+            logging.warning(f"Closing a broken database connection: {err}")
+            conn.close()
+        if conn.closed:
+            with self.condition:
+                self.in_use -= 1
+            self.discard(conn)
+            return
+        with self.condition:
+            self.idle.append((conn, time.monotonic()))
+            self.in_use -= 1
+            self.condition.notify()
+
+    @contextmanager
+    def connection(self):
+        """
+        Lend a connection for a with block and return it however the block exits, incl. by abort().
+        """
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def stats(self):
+        """
+        Provide pool usage counters, with wait times in seconds.
+        """
+        with self.condition:
+            return dict(max_size=self.max_size, size=self.size, idle=len(self.idle), in_use=self.in_use,
+                        max_in_use=self.max_in_use, requests=self.requests, waits=self.waits,
+                        wait_time=self.wait_time, max_wait_time=self.max_wait_time,
+                        mean_wait_time=self.wait_time / self.requests if self.requests else 0.0,
+                        timeouts=self.timeouts, opened=self.opened, closed=self.closed,
+                        failed_checks=self.failed_checks)
@@ -13,6 +13,11 @@ from flask import jsonify, abort, make_response
 from prophet import Prophet
 from requests.exceptions import HTTPError
 
+import binary_copy
+import connection_pool
+import queries
+import series_catalog
+
 app = Flask(__name__)
 PORT = 8086
 
@@ -25,8 +30,6 @@ DAY = 'DAY'
 LOW_ACCURACY = 'LOW'
 HIGH_ACCURACY = 'HIGH'
 
-TABLE = 'aggregated_data'
-
 
 class Prediction:
     def __init__(self, date, aggregation_mode, aggregation_interval, data_type, predicted_value):
@@ -39,15 +42,20 @@ class Prediction:
 
 def get_db_connection():
     """
-    Create a new database connection.
+    Create a new database connection for the connection pool, with the prepared queries.
     """
     conn = psycopg2.connect(host='localhost',
                             database='postgres',
                             user='postgres',
                             password='password')
+    queries.prepare(conn)
     return conn
 
 
+pool = connection_pool.ConnectionPool(get_db_connection)
+catalog = series_catalog.SeriesCatalog(pool)
+
+
 def get_last_day_of_month(date):
     if date.month == 12:
         return date.replace(day=31)
@@ -82,23 +90,17 @@ def get_daterange(aggregation_interval, date, accuracy):
 
 def get_query(data_type, aggregation_mode, aggregation_interval, start_date, end_date, freq):
     """
-    Define a query for extracting data from a database.
+    Choose a series query and its parameters for extracting data from a database.
     """
     str_start_date = datetime.datetime.strftime(start_date, "%Y-%m-%d")
     str_end_date = datetime.datetime.strftime(end_date, "%Y-%m-%d")
 
-    query = f"SELECT data_value, timestamp FROM {TABLE}" \
-            f" WHERE data_type = '{data_type}'" \
-            f" AND aggregation_mode = '{aggregation_mode}'" \
-            f" AND aggregation_interval = '{aggregation_interval}'" \
-            f" AND '[{str_start_date}, {str_end_date}]'::daterange @> timestamp"
-    if freq:
-        if aggregation_interval != YEAR:
-            query = query + f" AND DATE_PART('{MONTH.lower()}', timestamp) = {end_date.month}"
-        if aggregation_interval == DAY:
-            query = query + f" AND DATE_PART('{DAY.lower()}', timestamp) <= {end_date.day}"
-    query = query + f" ORDER BY timestamp"
-    return query
+    params = [data_type, aggregation_mode, aggregation_interval, str_start_date, str_end_date]
+    if (not freq) or (aggregation_interval == YEAR):
+        return 'series_range', params
+    if aggregation_interval == MONTH:
+        return 'series_range_month', params + [end_date.month]
+    return 'series_range_month_day', params + [end_date.month, end_date.day]
 
 
 def extract(data_type, date, accuracy, freq=False):
@@ -106,24 +108,22 @@ def extract(data_type, date, accuracy, freq=False):
     Extract data from a database.
     """
     try:
-        conn = get_db_connection()
-        cur = conn.cursor()
-        cur.execute(f"SELECT aggregation_mode, aggregation_interval"
-                    f" FROM {TABLE} WHERE data_type = '{data_type}'")
-        if cur.rowcount > 0:
-            aggregation_mode, aggregation_interval = cur.fetchone()
+        series = catalog.get_series(data_type)
+        if series is not None:
+            aggregation_mode, aggregation_interval = series.aggregation_mode, series.aggregation_interval
             start_date, end_date = get_daterange(aggregation_interval, date, accuracy)
-            query = get_query(data_type, aggregation_mode, aggregation_interval, start_date, end_date, freq)
-            logging.debug(f"Prediction query:\n{query}")
-            cur.execute(query)
-            if cur.rowcount > 0:
-                df = pd.DataFrame(cur.fetchall(), columns=['data_value', 'timestamp'])
-                cur.close()
-                conn.close()
-                return df, aggregation_mode, aggregation_interval, end_date
-            else:
-                logging.error("Not enough data to predict")
-                abort(400)
+            name, params = get_query(data_type, aggregation_mode, aggregation_interval, start_date, end_date,
+                                     freq)
+            logging.debug(f"Prediction query:\n{name} {params}")
+            with pool.connection() as conn, conn.cursor() as cur:
+                rows = series.estimate_rows(start_date, end_date)
+                values, timestamps = binary_copy.fetch_series(cur, name, params, rows)
+                if values.size > 0:
+                    df = pd.DataFrame({'data_value': values, 'timestamp': timestamps})
+                    return df, aggregation_mode, aggregation_interval, end_date
+                else:
+                    logging.error("Not enough data to predict")
+                    abort(400)
         else:
             logging.error("No data of this type")
             abort(400)
@@ -394,6 +394,26 @@ def predict():
     return create_response(prediction, 200)
 
 
+@app.route('/v1/connectionPool', methods=['GET'])
+def get_connection_pool():
+    """
+    Report the usage of the database connection pool, incl. the time requests waited for a connection.
+
+    :return: pool usage counters and a 200 OK response
+    """
+    return create_response(pool.stats(), 200)
+
+
+@app.route('/v1/seriesCatalog', methods=['GET'])
+def get_series_catalog():
+    """
+    Report the series catalog: every data type with its aggregation, row count and timestamp range.
+
+    :return: the series catalog and a 200 OK response
+    """
+    return create_response(catalog.stats(), 200)
+
+
 def create_response(body, code):
     response = make_response(
         jsonify(body),
@@ -0,0 +1,134 @@
+import datetime
+import logging
+import threading
+import time
+
+import queries
+
+REFRESH_INTERVAL = 60       # in seconds, between background refreshes
+MIN_MISS_INTERVAL = 5       # in seconds, between refreshes for data types missing in the catalog
+
+
+def get_date(value):
+    return value.date() if isinstance(value, datetime.datetime) else value
+
+
+class Series:
+    def __init__(self, data_type, aggregation_mode, aggregation_interval, count, min_timestamp, max_timestamp):
+        self.data_type = data_type                          # string
+        self.aggregation_mode = aggregation_mode            # string
+        self.aggregation_interval = aggregation_interval    # string
+        self.count = count                                  # int, number of rows
+        self.min_timestamp = min_timestamp                  # date
+        self.max_timestamp = max_timestamp                  # date
+
+    def estimate_rows(self, start_date=None, end_date=None):
+        """
+        Estimate the rows of the series between two dates, by default all of them, assuming evenly spaced rows.
+        """
+        if start_date is None or end_date is None:
+            return self.count
+        start = max(get_date(start_date), self.min_timestamp)
+        end = min(get_date(end_date), self.max_timestamp)
+        if end < start:
+            return 0
+        days = (self.max_timestamp - self.min_timestamp).days + 1
+        return round(self.count * ((end - start).days + 1) / days)
+
+
+class SeriesCatalog:
+    """
+    In-process catalog of the series in the aggregated data, one per combination of data type,
+    aggregation mode and aggregation interval, with row counts and timestamp ranges.
+    It is refreshed in the background, so requests look up the aggregation of a data type without a query.
+    A data type missing in the catalog triggers a refresh, at most every MIN_MISS_INTERVAL seconds,
+    for series that ms_fog started writing since the last refresh.
+    """
+
+    def __init__(self, pool, refresh_interval=REFRESH_INTERVAL):
+        self.pool = pool                            # ConnectionPool
+        self.refresh_interval = refresh_interval    # float, in seconds
+        self.lock = threading.Lock()
+        self.series = {}                            # dict of data type to list of Series, the latest written first
+        self.refreshed_at = None                    # datetime
+        self.last_refresh = 0.0                     # monotonic time of the last refresh
+        self.refreshes = 0
+        self.failures = 0
+        self.hits = 0
+        self.misses = 0
+        self.thread = None
+
+    def refresh(self):
+        with self.pool.connection() as conn, conn.cursor() as cur:
+            queries.execute(cur, 'series_catalog', [])
+            rows = cur.fetchall()
+        series = {}
+        for row in rows:
+            series.setdefault(row[0], []).append(Series(*row))
+        for data_type_series in series.values():
+            data_type_series.sort(key=lambda s: s.max_timestamp, reverse=True)
+        with self.lock:
+            self.series = series
+            self.refreshed_at = datetime.datetime.now(datetime.timezone.utc)
+            self.last_refresh = time.monotonic()
+            self.refreshes += 1
+        logging.debug(f"Refreshed the series catalog with {len(rows)} series")
+
+    def try_refresh(self):
+        try:
+            self.refresh()
+        except Exception as err:
+            with self.lock:
+                self.failures += 1
+                self.last_refresh = time.monotonic()
+            logging.error(f"Series catalog refresh failed: {err}")
+
+    def run(self):
+        while True:
+            time.sleep(self.refresh_interval)
+            self.try_refresh()
+
+    def start(self):
+        """
+        Load the catalog and keep refreshing it in a daemon thread, once per process on first use.
+        """
+        with self.lock:
+            if self.thread is not None:
+                return
+            self.thread = threading.Thread(target=self.run, daemon=True)
+        self.try_refresh()
+        self.thread.start()
+
+    def get_series(self, data_type):
+        """
+        Provide the series of a data type, the latest written if several aggregations exist, or None.
+        """
+        self.start()
+        with self.lock:
+            data_type_series = self.series.get(data_type)
+            if data_type_series:
+                self.hits += 1
+                return data_type_series[0]
+            self.misses += 1
+            refresh = time.monotonic() - self.last_refresh >= MIN_MISS_INTERVAL
+        if refresh:
+            self.try_refresh()
+            with self.lock:
+                data_type_series = self.series.get(data_type)
+                if data_type_series:
+                    return data_type_series[0]
+        return None
+
+    def stats(self):
+        """
+        Describe the catalog and its series.
+        """
+        self.start()
+        with self.lock:
+            series = [dict(data_type=s.data_type, aggregation_mode=s.aggregation_mode,
+                           aggregation_interval=s.aggregation_interval, count=s.count,
+                           min_timestamp=s.min_timestamp.isoformat(), max_timestamp=s.max_timestamp.isoformat())
+                      for data_type_series in self.series.values() for s in data_type_series]
+            return dict(refreshed_at=self.refreshed_at.isoformat() if self.refreshed_at else None,
+                        refresh_interval=self.refresh_interval, refreshes=self.refreshes, failures=self.failures,
+                        hits=self.hits, misses=self.misses, series=series)
@@ -0,0 +1,216 @@
+import csv
+import json
+import math
+import threading
+
+PERCENTILES = (50, 90, 99, 99.9)
+
+
+class HdrHistogram:
+    """
+    High dynamic range histogram of integer values, e.g. latencies in microseconds, like HdrHistogram.
+    Values between lowest and highest are counted in log-linear buckets, so every recorded value
+    is kept with the given number of significant figures at a fixed memory cost.
+    """
+
+    def __init__(self, lowest=1, highest=3600 * 10 ** 6, significant_figures=3):
+        self.lowest = lowest                            # int
+        self.highest = highest                          # int
+        self.significant_figures = significant_figures  # int
+        largest_single_unit = 2 * 10 ** significant_figures
+        self.sub_bucket_half_count_magnitude = math.ceil(math.log2(largest_single_unit)) - 1
+        self.sub_bucket_count = 2 ** (self.sub_bucket_half_count_magnitude + 1)
+        self.sub_bucket_half_count = self.sub_bucket_count // 2
+        self.unit_magnitude = int(math.floor(math.log2(lowest)))
+        self.sub_bucket_mask = (self.sub_bucket_count - 1) << self.unit_magnitude
+        smallest_untrackable = self.sub_bucket_count << self.unit_magnitude
+        bucket_count = 1
+        while smallest_untrackable <= highest:
+            smallest_untrackable <<= 1
+            bucket_count += 1
+        self.counts = [0] * ((bucket_count + 1) * self.sub_bucket_half_count)
+        self.total_count = 0
+        self.min = None
+        self.max = None
+
+    def get_bucket(self, value):
+        bucket_index = (value | self.sub_bucket_mask).bit_length() - self.unit_magnitude \
+            - (self.sub_bucket_half_count_magnitude + 1)
+        sub_bucket_index = value >> (bucket_index + self.unit_magnitude)
+        return bucket_index, sub_bucket_index
+
+    def get_index(self, value):
+        bucket_index, sub_bucket_index = self.get_bucket(value)
+        return ((bucket_index + 1) << self.sub_bucket_half_count_magnitude) \
+            + sub_bucket_index - self.sub_bucket_half_count
+
+    def get_value(self, index):
+        """
+        Provide the lowest value counted at an index.
+        """
+        bucket_index = (index >> self.sub_bucket_half_count_magnitude) - 1
+        sub_bucket_index = (index & (self.sub_bucket_half_count - 1)) + self.sub_bucket_half_count
+        if bucket_index < 0:
+            sub_bucket_index -= self.sub_bucket_half_count
+            bucket_index = 0
+        return sub_bucket_index << (bucket_index + self.unit_magnitude)
+
+    def get_highest_equivalent_value(self, value):
+        bucket_index, sub_bucket_index = self.get_bucket(value)
+        if sub_bucket_index >= self.sub_bucket_count:
+            bucket_index += 1
+        lowest_equivalent_value = self.get_value(self.get_index(value))
+        return lowest_equivalent_value + (1 << (self.unit_magnitude + bucket_index)) - 1
+
+    def record(self, value, count=1):
+        value = min(max(int(value), self.lowest), self.highest)
+        self.counts[self.get_index(value)] += count
+        self.total_count += count
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def add(self, other):
+        """
+        Merge the counts of a histogram with the same settings.
+        """
+        for index, count in enumerate(other.counts):
+            if count:
+                self.counts[index] += count
+        self.total_count += other.total_count
+        if other.total_count:
+            self.min = other.min if self.min is None else min(self.min, other.min)
+            self.max = other.max if self.max is None else max(self.max, other.max)
+
+    def get_value_at_percentile(self, percentile):
+        if self.total_count == 0:
+            return None
+        target = max(math.ceil(self.total_count * percentile / 100), 1)
+        cumulative = 0
+        for index, count in enumerate(self.counts):
+            cumulative += count
+            if cumulative >= target:
+                return min(self.get_highest_equivalent_value(self.get_value(index)), self.max)
+        return self.max
+
+
+class Recorder:
+    """
+    Response times and outcomes of the requests of a run per endpoint and prediction model.
+    The response time is measured from the intended send time, so requests that are sent late
+    because the load generator fell behind are not reported as fast (coordinated omission),
+    and the service time from the actual send time.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.response_times = {}    # (endpoint, model) -> HdrHistogram in microseconds
+        self.service_times = {}     # (endpoint, model) -> HdrHistogram in microseconds
+        self.statuses = {}          # (endpoint, model) -> status -> count
+        self.start = None           # float, monotonic time of the first intended send
+        self.end = None             # float, monotonic time of the last response
+        self.taps = []              # objects with a record method like this one, also given every request
+
+    def record(self, endpoint, model, status, intended, sent, received):
+        """
+        Record the status and the times in seconds of a request.
+        status is the HTTP status code or the name of the exception raised instead of a response.
+        """
+        key = (endpoint, model or '')
+        with self.lock:
+            if key not in self.response_times:
+                self.response_times[key] = HdrHistogram()
+                self.service_times[key] = HdrHistogram()
+                self.statuses[key] = {}
+            self.response_times[key].record((received - intended) * 10 ** 6)
+            self.service_times[key].record((received - sent) * 10 ** 6)
+            self.statuses[key][str(status)] = self.statuses[key].get(str(status), 0) + 1
+            self.start = intended if self.start is None else min(self.start, intended)
+            self.end = received if self.end is None else max(self.end, received)
+        for tap in self.taps:
+            tap.record(endpoint, model, status, intended, sent, received)
+
+    def get_state(self):
+        """
+        Provide the recorded data, e.g. to send it from a worker process to the one merging the report.
+        """
+        with self.lock:
+            return dict(response_times=self.response_times, service_times=self.service_times,
+                        statuses=self.statuses, start=self.start, end=self.end)
+
+    def reset(self):
+        """
+        Provide the recorded data like get_state and start over, e.g. at the end of a measurement window.
+        """
+        with self.lock:
+            state = dict(response_times=self.response_times, service_times=self.service_times,
+                         statuses=self.statuses, start=self.start, end=self.end)
+            self.response_times = {}
+            self.service_times = {}
+            self.statuses = {}
+            self.start = None
+            self.end = None
+            return state
+
+    def merge(self, state):
+        """
+        Add the data recorded by another recorder, as provided by get_state.
+        Monotonic times of processes on the same machine are comparable.
+        """
+        with self.lock:
+            for key, histogram in state['response_times'].items():
+                if key not in self.response_times:
+                    self.response_times[key] = HdrHistogram()
+                    self.service_times[key] = HdrHistogram()
+                    self.statuses[key] = {}
+                self.response_times[key].add(histogram)
+                self.service_times[key].add(state['service_times'][key])
+                for status, count in state['statuses'][key].items():
+                    self.statuses[key][status] = self.statuses[key].get(status, 0) + count
+            if state['start'] is not None:
+                self.start = state['start'] if self.start is None else min(self.start, state['start'])
+                self.end = state['end'] if self.end is None else max(self.end, state['end'])
+
+    def get_report(self):
+        """
+        Provide the count, errors, throughput and latency percentiles in milliseconds per endpoint and model.
+        """
+        with self.lock:
+            elapsed = self.end - self.start if self.start is not None else 0.0
+            report = []
+            for key in sorted(self.response_times):
+                endpoint, model = key
+                statuses = self.statuses[key]
+                count = sum(statuses.values())
+                errors = {status: n for status, n in statuses.items() if not status.isdigit() or int(status) >= 400}
+                row = dict(endpoint=endpoint, model=model, count=count, errors=errors,
+                           throughput=count / elapsed if elapsed > 0 else None)
+                for name, histogram in (('response_time', self.response_times[key]),
+                                        ('service_time', self.service_times[key])):
+                    row[name] = {f"p{percentile:g}": histogram.get_value_at_percentile(percentile) / 1000
+                                 for percentile in PERCENTILES}
+                    row[name]['max'] = histogram.max / 1000
+                report.append(row)
+            return dict(duration=elapsed, endpoints=report)
+
+
+def write_report(report, path):
+    """
+    Write a report as JSON, or as CSV with one row per endpoint and model if the path ends with .csv.
+    """
+    if not path.endswith('.csv'):
+        with open(path, 'w') as file:
+            json.dump(report, file, indent=2)
+        return
+    rows = []
+    for endpoint in report['endpoints']:
+        row = dict(endpoint=endpoint['endpoint'], model=endpoint['model'], count=endpoint['count'],
+                   errors=sum(endpoint['errors'].values()), throughput=endpoint['throughput'])
+        for name in ('response_time', 'service_time'):
+            for statistic, value in endpoint[name].items():
+                row[f"{name}_{statistic}"] = value
+        rows.append(row)
+    with open(path, 'w', newline='') as file:
+        if rows:
+            writer = csv.DictWriter(file, fieldnames=list(rows[0].keys()))
+            writer.writeheader()
+            writer.writerows(rows)
@@ -0,0 +1,165 @@
+import argparse
+import asyncio
+import logging
+import time
+
+from latency import Recorder
+from runner import recorder
+
+ANY = 'any'  # stop when the first endpoint breaches the SLO
+ALL = 'all'  # stop when all endpoints breached the SLO
+
+
+def parse_ramp(text):
+    """
+    Parse a step ramp like "10,10,500" of start, step and maximum rate in requests per second.
+    """
+    rates = [float(rate) for rate in text.split(',')]
+    if len(rates) != 3:
+        raise argparse.ArgumentTypeError(f"Expected start, step and maximum rate, got {text}")
+    start_rate, step_rate, max_rate = rates
+    if start_rate <= 0 or step_rate <= 0:
+        raise argparse.ArgumentTypeError(f"Start and step rate must be positive, got {text}")
+    if max_rate < start_rate:
+        raise argparse.ArgumentTypeError(f"Maximum rate must be at least the start rate, got {text}")
+    return rates
+
+
+def get_window_stats(window_recorder, window):
+    """
+    Provide the successful requests per second, the p99 response time in milliseconds and the error rate
+    per endpoint and prediction model of a measurement window.
+    """
+    stats = {}
+    for endpoint in window_recorder.get_report()['endpoints']:
+        errors = sum(endpoint['errors'].values())
+        key = f"{endpoint['endpoint']} {endpoint['model']}".strip()
+        stats[key] = dict(throughput=(endpoint['count'] - errors) / window, p99=endpoint['response_time']['p99'],
+                          error_rate=errors / endpoint['count'])
+    return stats
+
+
+class WindowRecorder:
+    """
+    Recorders of the measurement windows of window seconds from start, fed as a tap of the recorder of the run.
+    A request belongs to the window of its intended send time, however late it is answered.
+    """
+
+    def __init__(self, start, window):
+        self.start = start      # float, monotonic time
+        self.window = window    # float, in seconds
+        self.windows = {}       # window number -> Recorder
+
+    def record(self, endpoint, model, status, intended, sent, received):
+        number = int((intended - self.start) // self.window)
+        self.windows.setdefault(number, Recorder()).record(endpoint, model, status, intended, sent, received)
+
+    def pop(self, number):
+        return self.windows.pop(number, None) or Recorder()
+
+
+class StepRamp:
+    """
+    Step load: the open-loop rate grows by step_rate per step, and each step is held in windows of
+    window seconds until the p99 of every endpoint changes by less than the tolerance between two windows.
+    Requests are sent without pausing between windows, so queueing at saturation shows in the latency,
+    and a window is measured once its own requests have been answered while the next windows are sent.
+    The ramp stops when an endpoint breaches the SLO, a p99 bound or an error rate, and the knee of
+    an endpoint is its throughput at the last step it met the SLO.
+    """
+
+    def __init__(self, start_rate, step_rate, max_rate, max_p99, max_error_rate=0.01, window=10, min_windows=3,
+                 max_windows=12, tolerance=0.1, stop=ANY):
+        self.start_rate = start_rate            # float, requests per second
+        self.step_rate = step_rate              # float, requests per second
+        self.max_rate = max_rate                # float, requests per second
+        self.max_p99 = max_p99                  # float, in milliseconds
+        self.max_error_rate = max_error_rate    # float, 0 - 1
+        self.window = window                    # float, in seconds
+        self.min_windows = min_windows          # int, per step
+        self.max_windows = max_windows          # int, per step
+        self.tolerance = tolerance              # float, relative change of the p99
+        self.stop = stop                        # string
+        self.rate = start_rate                  # float, rate of the current step
+
+    def is_stable(self, previous, stats):
+        for key, endpoint in stats.items():
+            if key not in previous:
+                return False
+            if abs(endpoint['p99'] - previous[key]['p99']) > self.tolerance * previous[key]['p99']:
+                return False
+        return True
+
+    def is_breached(self, endpoint):
+        return endpoint['p99'] > self.max_p99 or endpoint['error_rate'] > self.max_error_rate
+
+    async def send(self, engine, arrivals, mix, start, sent_windows):
+        """
+        Send window after window at the rate of the current step, each starting where the previous one ended,
+        and queue the number, the rate and the requests still in flight of every window.
+        """
+        number = 0
+        while True:
+            rate = self.rate
+            before = set(engine.tasks)
+            await engine.run_open_loop(rate, self.window, arrivals, mix, start + number * self.window)
+            await sent_windows.put((number, rate, set(engine.tasks) - before))
+            number += 1
+
+    async def hold(self, sent_windows, window_recorder):
+        """
+        Hold the rate of the current step until the latency is stable or the SLO is breached,
+        and provide the stats of the last window.
+        """
+        previous = None
+        stats = {}
+        window_number = 0
+        while window_number < self.max_windows:
+            number, rate, tasks = await sent_windows.get()
+            # the requests of the window belong to it, however long they take
+            await asyncio.gather(*tasks, return_exceptions=True)
+            window_stats_recorder = window_recorder.pop(number)
+            if rate != self.rate:
+                continue  # sent at the rate of the previous step, before the current one began
+            window_number += 1
+            stats = get_window_stats(window_stats_recorder, self.window)
+            if window_number >= self.min_windows:
+                if previous is not None and self.is_stable(previous, stats):
+                    return stats, window_number, True
+                if any(self.is_breached(endpoint) for endpoint in stats.values()):
+                    return stats, window_number, False
+            previous = stats
+        return stats, self.max_windows, False
+
+    async def run(self, engine, arrivals, mix):
+        """
+        Run the ramp with the engine and provide the steps and the knees.
+        """
+        steps = []
+        knees = {}
+        breached = set()
+        window_recorder = WindowRecorder(time.monotonic(), self.window)
+        recorder.taps.append(window_recorder)
+        sent_windows = asyncio.Queue()
+        self.rate = self.start_rate
+        sender = asyncio.create_task(self.send(engine, arrivals, mix, window_recorder.start, sent_windows))
+        try:
+            while self.rate <= self.max_rate:
+                stats, windows, stable = await self.hold(sent_windows, window_recorder)
+                steps.append(dict(rate=self.rate, windows=windows, stable=stable, endpoints=stats))
+                for key, endpoint in stats.items():
+                    if key in breached:
+                        continue
+                    if self.is_breached(endpoint):
+                        breached.add(key)
+                        logging.info(f"{key} breached the SLO at {self.rate} requests per second: {endpoint}")
+                    else:
+                        knees[key] = dict(rate=self.rate, **endpoint)
+                logging.info(f"Step of {self.rate} requests per second: {windows} windows, stable {stable}")
+                if breached and (self.stop == ANY or breached >= set(stats)):
+                    break
+                self.rate += self.step_rate
+        finally:
+            sender.cancel()
+            recorder.taps.remove(window_recorder)
+        return dict(steps=steps, knees=knees, breached=sorted(breached))
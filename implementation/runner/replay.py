@@ -0,0 +1,85 @@
+import json
+from datetime import datetime
+from urllib.parse import parse_qs, urlencode
+
+MAX_SPEED = 0  # replay without waiting between requests
+
+
+class LoggedRequest:
+    def __init__(self, offset, method, path, query, data, request_class, model):
+        self.offset = offset                    # float, in seconds since the first logged request
+        self.method = method                    # string
+        self.path = path                        # string, e.g. /api/predict
+        self.query = query                      # string, encoded query parameters
+        self.data = data                        # bytes or None
+        self.request_class = request_class      # string, e.g. POST /api/predict
+        self.model = model                      # string or None
+
+
+def parse_speed(text):
+    """
+    Parse a replay speed like 1, 2.5, 10x or max.
+    """
+    if text == 'max':
+        return MAX_SPEED
+    return float(text.rstrip('x'))
+
+
+def parse_timestamp(timestamp):
+    """
+    Convert a logged timestamp, in seconds since the epoch or in ISO 8601, to seconds.
+    """
+    if isinstance(timestamp, (int, float)):
+        return float(timestamp)
+    return datetime.fromisoformat(timestamp.replace('Z', '+00:00')).timestamp()
+
+
+def encode_query(query):
+    if not query:
+        return ''
+    if isinstance(query, dict):
+        return urlencode(query, doseq=True)
+    return query.lstrip('?')
+
+
+def encode_body(body):
+    if body is None:
+        return None
+    if isinstance(body, str):
+        return body.encode()
+    return json.dumps(body, separators=(',', ':')).encode()
+
+
+def get_request_class(method, path, query):
+    """
+    Classify a request by method and path, and by prediction model for predictions.
+    """
+    model = None
+    if path.endswith('/predict'):
+        model = parse_qs(query).get('predictionModel', ['default'])[0]
+    return f"{method} {path}", model
+
+
+def read_log(path, shard=0, shards=1):
+    """
+    Stream the requests of a JSONL request log with method, path, query, body and timestamp per line,
+    with their offsets from the first request. Lines are split across shards.
+    """
+    first_timestamp = None
+    with open(path) as file:
+        index = 0
+        for line in file:
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            timestamp = parse_timestamp(entry['timestamp'])
+            if first_timestamp is None:
+                first_timestamp = timestamp
+            index += 1
+            if (index - 1) % shards != shard:
+                continue
+            method = entry.get('method', 'GET').upper()
+            query = encode_query(entry.get('query'))
+            request_class, model = get_request_class(method, entry['path'], query)
+            yield LoggedRequest(timestamp - first_timestamp, method, entry['path'], query,
+                                encode_body(entry.get('body')), request_class, model)
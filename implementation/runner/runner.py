@@ -1,12 +1,15 @@
+import argparse
 import logging
 import random
+import threading
 import time
 from concurrent.futures import ThreadPoolExecutor, as_completed
-from datetime import datetime
+from datetime import datetime, timedelta
 
 import requests
 from dateutil.relativedelta import relativedelta
-from faker import Faker
+
+from latency import Recorder, write_report
 
 IOT_PORTS = [8080, 8081]
 PREDICTION_PORT = 8086
@@ -17,8 +20,22 @@ data_types = ['PRESSURE', 'TEMPERATURE']
 prediction_accuracies = ['LOW', 'HIGH']
 prediction_models = [None, 'ExponentialSmoothing', 'Prophet']
 
+# open-loop mode
+POISSON = 'poisson'
+CONSTANT = 'constant'
+ENDPOINT_MIX = dict(detectAnomaly=1, predict=3, assessPredictions=1, getAccuratePrediction=1,
+                    getValidPredictions=1)  # relative weights of the endpoints
+STEP_INTERVAL = 30  # in seconds, between the rounds of run() and between the steps of the date range
+MAX_IN_FLIGHT = 1000  # concurrent requests
+MAX_SEND_LAG = 0.001  # in seconds, later sends are reported as late
+
+recorder = Recorder()
+gateway = None  # host:port of the API gateway to send all requests to, e.g. localhost:8090
+
 
 def get_url(host, port, path):
+    if gateway is not None:
+        return f"http://{gateway}{path}"
     # run bachelor/implementation
     # url = f"http://{host}:{port}{path}"
     # run bachelor/istio
@@ -26,6 +43,23 @@ def get_url(host, port, path):
     return url
 
 
+def send(endpoint, method, url, body, model=None, intended=None):
+    """
+    Send a request and record its latency and status.
+    intended is the monotonic time at which the request should have been sent, by default the actual send time.
+    """
+    sent = time.monotonic()
+    try:
+        response = requests.request(method, url, json=body)
+        status = response.status_code
+    except requests.RequestException as err:
+        logging.error(f"{endpoint}: {err}")
+        response = None
+        status = type(err).__name__
+    recorder.record(endpoint, model, status, intended or sent, sent, time.monotonic())
+    return response
+
+
 def generate_data(data_type, port):
     duration = 300000  # in milliseconds
     url = get_url('localhost', port, '/api/generateSensorData?requestDuration=' + str(duration))
@@ -33,16 +67,16 @@ def generate_data(data_type, port):
     sensor_type = data_type
     body = dict(id=sensor_id, type=sensor_type)
     logging.info(f"Start data generation of type {data_type} on {port}")
-    requests.post(url, json=body)
+    send('generateSensorData', 'POST', url, body)
 
 
-def get_random_anomaly_thresholds(data_type):
+def get_random_anomaly_thresholds(data_type, rng=random):
     if data_type == 'TEMPERATURE':
-        low_value = random.uniform(-50, 50)
-        high_value = random.uniform(-50, 50)
+        low_value = rng.uniform(-50, 50)
+        high_value = rng.uniform(-50, 50)
     else:
-        low_value = random.uniform(980, 1030)
-        high_value = random.uniform(980, 1030)
+        low_value = rng.uniform(980, 1030)
+        high_value = rng.uniform(980, 1030)
     if low_value > high_value:
         temp = low_value
         low_value = high_value
@@ -50,41 +84,86 @@ def get_random_anomaly_thresholds(data_type):
     return low_value, high_value
 
 
-def detect_anomaly(thresholds, date_start, date_end):
-    data_type = random.choice(data_types)
+def get_random_date(date_start, date_end, rng=random):
+    """
+    Choose a date between two dates, both included.
+    """
+    return date_start + timedelta(days=rng.randint(0, (date_end - date_start).days))
+
+
+def get_anomaly_path(thresholds, date_start, date_end, rng=random):
+    """
+    Provide the path and body of a random anomaly detection request.
+    """
+    data_type = rng.choice(data_types)
     if thresholds:
-        url = get_url('localhost', ANOMALY_DETECTION_PORT, '/api/detectAnomaly?thresholds=' + str(thresholds))
-        start_date = Faker().date_between_dates(date_start=date_start, date_end=date_end)
+        path = '/api/detectAnomaly?thresholds=' + str(thresholds)
+        start_date = get_random_date(date_start, date_end, rng)
         start_date = datetime.strftime(start_date, "%Y-%m-%d")
         end_date = datetime.strftime(date_end, "%Y-%m-%d")
-        low_value, high_value = get_random_anomaly_thresholds(data_type)
+        low_value, high_value = get_random_anomaly_thresholds(data_type, rng)
         body = dict(type=data_type, start_date=start_date, end_date=end_date,
                     low_value=low_value, high_value=high_value)
-        logging.info(f"Detect {data_type} anomaly from {start_date} to {end_date} "
-                     f"with thresholds {low_value}, {high_value}")
     else:
-        url = get_url('localhost', ANOMALY_DETECTION_PORT, '/api/detectAnomaly')
+        path = '/api/detectAnomaly'
         body = dict(type=data_type)
-        logging.info(f"Detect {data_type} anomaly")
-    requests.post(url, json=body)
+    return path, body
+
+
+def get_anomaly_request(thresholds, date_start, date_end, rng=random):
+    """
+    Provide the URL and body of a random anomaly detection request.
+    """
+    path, body = get_anomaly_path(thresholds, date_start, date_end, rng)
+    return get_url('localhost', ANOMALY_DETECTION_PORT, path), body
+
 
+def log_anomaly_request(body):
+    if 'start_date' in body:
+        logging.info(f"Detect {body['type']} anomaly from {body['start_date']} to {body['end_date']} "
+                     f"with thresholds {body['low_value']}, {body['high_value']}")
+    else:
+        logging.info(f"Detect {body['type']} anomaly")
+
+
+def detect_anomaly(thresholds, date_start, date_end, intended=None):
+    url, body = get_anomaly_request(thresholds, date_start, date_end)
+    log_anomaly_request(body)
+    send('detectAnomaly', 'POST', url, body, intended=intended)
 
-def get_random_prediction_body(date_start, date_end):
-    data_type = random.choice(data_types)
-    date = Faker().date_between(start_date=random.choice((date_start, date_end)))
+
+def get_random_prediction_body(date_start, date_end, rng=random, today=None):
+    """
+    Provide the body of a prediction request for a date between one of the given dates and today.
+    """
+    data_type = rng.choice(data_types)
+    date = get_random_date(rng.choice((date_start, date_end)), today or datetime.today(), rng)
     date = datetime.strftime(date, "%Y-%m-%d")
-    accuracy = random.choice(prediction_accuracies)
+    accuracy = rng.choice(prediction_accuracies)
     body = dict(type=data_type, date=date, accuracy=accuracy)
-    logging.info(f"Predict {data_type} for {date} with {accuracy} accuracy")
     return body
 
 
-def predict(model, body):
+def log_prediction_body(body):
+    logging.info(f"Predict {body['type']} for {body['date']} with {body['accuracy']} accuracy")
+
+
+def get_prediction_path(model):
     if model is not None:
-        url = get_url('localhost', PREDICTION_PORT, '/api/predict?predictionModel=' + model)
-    else:
-        url = get_url('localhost', PREDICTION_PORT, '/api/predict')
-    response = requests.post(url, json=body)
+        return '/api/predict?predictionModel=' + model
+    return '/api/predict'
+
+
+def get_prediction_url(model):
+    url = get_url('localhost', PREDICTION_PORT, get_prediction_path(model))
+    return url
+
+
+def predict(model, body, intended=None):
+    url = get_prediction_url(model)
+    response = send('predict', 'POST', url, body, model=model or 'default', intended=intended)
+    if response is None:
+        return None
     try:
         prediction = response.json()
     except (Exception, ValueError):
@@ -92,11 +171,12 @@ def predict(model, body):
     return prediction
 
 
-def get_predictions(executor, date_start, date_end):
+def get_predictions(executor, date_start, date_end, intended=None):
     predictions = []
     prediction_body = get_random_prediction_body(date_start, date_end)
+    log_prediction_body(prediction_body)
     # dispatch tasks into the thread pool and create a list of futures
-    futures = [executor.submit(predict, model, prediction_body) for model in prediction_models]
+    futures = [executor.submit(predict, model, prediction_body, intended) for model in prediction_models]
     # iterate over all submitted tasks and get results as they are available
     for future in as_completed(futures):
         # get the result for the next completed task
@@ -105,25 +185,143 @@ def get_predictions(executor, date_start, date_end):
     return predictions
 
 
-def assess_predictions(predictions):
+def assess_predictions(predictions, intended=None):
     url = get_url('localhost', ANALYTICS_PORT, '/api/assessPredictions')
     body = dict(predictions=predictions)
     logging.info(f"Assess predictions: {predictions}")
-    requests.post(url, json=body)
+    send('assessPredictions', 'POST', url, body, intended=intended)
 
 
-def get_accurate_prediction(predictions):
+def get_accurate_prediction(predictions, intended=None):
     url = get_url('localhost', ANALYTICS_PORT, '/api/getAccuratePrediction')
     body = dict(predictions=predictions)
     logging.info(f"Get accurate prediction from {predictions}")
-    requests.post(url, json=body)
+    send('getAccuratePrediction', 'POST', url, body, intended=intended)
 
 
-def get_valid_predictions(predictions):
+def get_valid_predictions(predictions, intended=None):
     url = get_url('localhost', ANALYTICS_PORT, '/api/getValidPredictions')
     body = dict(predictions=predictions)
     logging.info(f"Get valid predictions: {predictions}")
-    requests.delete(url, json=body)
+    send('getValidPredictions', 'DELETE', url, body, intended=intended)
+
+
+def get_interarrival_times(rate, arrivals=POISSON, rng=random):
+    """
+    Generate the gaps in seconds between the intended send times of requests at the given rate per second.
+    """
+    while True:
+        if arrivals == POISSON:
+            yield rng.expovariate(rate)
+        else:
+            yield 1 / rate
+
+
+def parse_rate(text):
+    """
+    Parse a positive rate in requests per second.
+    """
+    rate = float(text)
+    if rate <= 0:
+        raise argparse.ArgumentTypeError(f"Rate must be positive, got {text}")
+    return rate
+
+
+def check_mix(mix):
+    """
+    Check that an endpoint mix names known endpoints with non-negative weights, at least one of them positive.
+    """
+    for endpoint, weight in mix.items():
+        if endpoint not in ENDPOINT_MIX:
+            raise argparse.ArgumentTypeError(f"Unknown endpoint {endpoint}")
+        if weight < 0:
+            raise argparse.ArgumentTypeError(f"Weight of {endpoint} must not be negative, got {weight}")
+    if not any(mix.values()):
+        raise argparse.ArgumentTypeError(f"At least one weight must be positive, got {mix}")
+    return mix
+
+
+def parse_mix(text):
+    """
+    Parse an endpoint mix like "predict=3,detectAnomaly=1".
+    """
+    mix = {}
+    for item in text.split(','):
+        endpoint, weight = item.split('=')
+        mix[endpoint] = float(weight)
+    return check_mix(mix)
+
+
+class OpenLoop:
+    """
+    Open-loop load generation: requests are sent at their intended send times,
+    no matter how long earlier requests take, so the offered load does not drop as the system slows down.
+    The analytics endpoints use the predictions of the latest predict requests.
+    """
+
+    def __init__(self, rate, duration, arrivals=POISSON, mix=ENDPOINT_MIX, max_in_flight=MAX_IN_FLIGHT):
+        self.rate = rate                    # float, requests per second
+        self.duration = duration            # float, in seconds
+        self.arrivals = arrivals            # string
+        self.endpoints = list(mix.keys())
+        self.weights = list(mix.values())
+        self.max_in_flight = max_in_flight  # int
+        self.lock = threading.Lock()
+        self.predictions = [None] * len(prediction_models)
+        self.sent = 0
+        self.late = 0
+        self.max_lag = 0.0                  # float, in seconds
+
+    def predict(self, model, body, intended):
+        prediction = predict(model, body, intended)
+        if prediction is not None:
+            with self.lock:
+                self.predictions[prediction_models.index(model)] = prediction
+
+    def send(self, endpoint, date_start, date_end, intended):
+        with self.lock:
+            predictions = list(self.predictions)
+        if endpoint == 'detectAnomaly':
+            detect_anomaly(bool(random.getrandbits(1)), date_start, date_end, intended)
+        elif endpoint == 'predict' or all(prediction is None for prediction in predictions):
+            body = get_random_prediction_body(date_start, date_end)
+            log_prediction_body(body)
+            self.predict(random.choice(prediction_models), body, intended)
+        elif endpoint == 'assessPredictions':
+            assess_predictions(predictions, intended)
+        elif endpoint == 'getAccuratePrediction':
+            get_accurate_prediction(predictions, intended)
+        else:
+            get_valid_predictions(predictions, intended)
+
+    def run(self, executor):
+        date_start = datetime(1971, 1, 1)
+        date_step = relativedelta(years=1)
+        start = time.monotonic()
+        scheduled = 0.0  # intended send time relative to start
+        for interarrival_time in get_interarrival_times(self.rate, self.arrivals):
+            scheduled += interarrival_time
+            if scheduled >= self.duration:
+                break
+            delay = start + scheduled - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            elif -delay > MAX_SEND_LAG:
+                self.late += 1
+                self.max_lag = max(self.max_lag, -delay)
+            date_end = date_start + date_step * (1 + int(scheduled // STEP_INTERVAL))
+            endpoint = random.choices(self.endpoints, self.weights)[0]
+            executor.submit(self.send, endpoint, date_start, date_end, start + scheduled)  # does not block
+            self.sent += 1
+        logging.info(f"Sent {self.sent} requests in {time.monotonic() - start:.1f} seconds, "
+                     f"{self.late} late by up to {self.max_lag:.3f} seconds")
+
+
+def run_open_loop(rate, duration, arrivals=POISSON, mix=ENDPOINT_MIX, max_in_flight=MAX_IN_FLIGHT):
+    # the data generation runs for minutes, so it must not hold up the end of the run
+    threading.Thread(target=generate_data, args=(data_types[0], IOT_PORTS[0]), daemon=True).start()
+    with ThreadPoolExecutor(max_workers=max_in_flight) as executor:
+        OpenLoop(rate, duration, arrivals, mix, max_in_flight).run(executor)
 
 
 def run():
@@ -135,17 +333,58 @@ def run():
         # submit a task with arguments
         executor.submit(generate_data, data_types[0], IOT_PORTS[0])  # does not block
         # executor.submit(generate_data, data_types[1], IOT_PORTS[1])
+        # each round is intended to start 30 seconds after the previous one, however long its predictions take
+        intended = time.monotonic() + STEP_INTERVAL
         while True:
-            time.sleep(30)  # in seconds
+            time.sleep(STEP_INTERVAL)  # in seconds
+            round_start = time.monotonic()
             date_end = date_end + date_step
-            executor.submit(detect_anomaly, bool(random.getrandbits(1)), date_start, date_end)
-            predictions = get_predictions(executor, date_start, date_end)
+            executor.submit(detect_anomaly, bool(random.getrandbits(1)), date_start, date_end, intended)
+            predictions = get_predictions(executor, date_start, date_end, intended)
+            intended = round_start + STEP_INTERVAL
             if any(prediction is not None for prediction in predictions):
                 executor.submit(assess_predictions, predictions)
                 executor.submit(get_accurate_prediction, predictions)
                 executor.submit(get_valid_predictions, predictions)
 
 
+def finish(report_paths):
+    """
+    Log the latency report of the run and write it to the given files.
+    """
+    report = recorder.get_report()
+    for endpoint in report['endpoints']:
+        logging.info(f"{endpoint['endpoint']} {endpoint['model']}: {endpoint['count']} requests, "
+                     f"errors {endpoint['errors']}, response time {endpoint['response_time']} ms")
+    for path in report_paths:
+        write_report(report, path)
+
+
+def main():
+    global gateway
+    parser = argparse.ArgumentParser(description="Simulate client activity.")
+    parser.add_argument('--gateway', help="host:port of the API gateway, instead of the Istio ingress")
+    parser.add_argument('--rate', type=parse_rate,
+                        help="requests per second sent in an open loop, instead of the closed loop of run()")
+    parser.add_argument('--duration', type=float, default=600, help="in seconds, for the open loop")
+    parser.add_argument('--arrivals', choices=(POISSON, CONSTANT), default=POISSON)
+    parser.add_argument('--mix', type=parse_mix, default=ENDPOINT_MIX,
+                        help="relative weights of the endpoints, e.g. predict=3,detectAnomaly=1")
+    parser.add_argument('--max-in-flight', type=int, default=MAX_IN_FLIGHT)
+    parser.add_argument('--report', action='append', default=[],
+                        help="file to write the latency report to at the end of the run, .json or .csv")
+    args = parser.parse_args()
+    gateway = args.gateway
+    try:
+        if args.rate is None:
+            run()
+        else:
+            run_open_loop(args.rate, args.duration, args.arrivals, args.mix, args.max_in_flight)
+    except KeyboardInterrupt:
+        logging.info("Stopped")
+    finish(args.report)
+
+
 if __name__ == '__main__':
     logging.getLogger().setLevel(logging.DEBUG)
-    run()
+    main()
@@ -0,0 +1,408 @@
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import random
+import time
+from datetime import datetime
+
+from aiohttp import ClientSession, ClientTimeout, TCPConnector, ClientError
+from dateutil.relativedelta import relativedelta
+
+import runner
+from runner import ANALYTICS_PORT, ENDPOINT_MIX, IOT_PORTS, POISSON, CONSTANT, STEP_INTERVAL, MAX_SEND_LAG, \
+    data_types, prediction_models, recorder, get_url, get_anomaly_request, get_random_prediction_body, \
+    get_prediction_url, get_interarrival_times, parse_mix, parse_rate, finish, log_anomaly_request, log_prediction_body
+from ramp import ANY, ALL, StepRamp, parse_ramp
+from replay import MAX_SPEED, parse_speed, read_log
+from workload import METHODS, NO_ROUND, PORTS, ANALYTICS_ENDPOINTS, get_dates, read_workload
+
+MAX_CONNECTIONS = 1000  # shared by all virtual users
+SHARD_STARTUP = 1.0  # in seconds, from starting the worker processes until they start their open loops
+JSON_HEADERS = {'Content-Type': 'application/json'}
+REPLAY_TARGET = 'http://localhost'  # where logged requests are sent to without a gateway
+
+
+async def send(session, endpoint, method, url, body, model=None, intended=None, data=None):
+    """
+    Send a request and record its latency and status. Provide the response body, None on a connection error.
+    data is the already encoded JSON body, sent instead of body.
+    """
+    sent = time.monotonic()
+    try:
+        if data is not None:
+            request = session.request(method, url, data=data, headers=JSON_HEADERS)
+        else:
+            request = session.request(method, url, json=body)
+        async with request as response:
+            content = await response.read()
+            status = response.status
+    except (ClientError, asyncio.TimeoutError) as err:
+        logging.error(f"{endpoint}: {err}")
+        content = None
+        status = type(err).__name__
+    recorder.record(endpoint, model, status, intended or sent, sent, time.monotonic())
+    return content
+
+
+async def generate_data(session, data_type, port):
+    duration = 300000  # in milliseconds
+    url = get_url('localhost', port, '/api/generateSensorData?requestDuration=' + str(duration))
+    body = dict(id=random.randint(1, 100), type=data_type)
+    logging.info(f"Start data generation of type {data_type} on {port}")
+    await send(session, 'generateSensorData', 'POST', url, body)
+
+
+async def detect_anomaly(session, thresholds, date_start, date_end, intended=None):
+    url, body = get_anomaly_request(thresholds, date_start, date_end)
+    log_anomaly_request(body)
+    await send(session, 'detectAnomaly', 'POST', url, body, intended=intended)
+
+
+def parse_prediction(content):
+    if content is None:
+        return None
+    try:
+        prediction = json.loads(content)
+    except ValueError:
+        prediction = None
+    return prediction
+
+
+async def predict(session, model, body, intended=None):
+    content = await send(session, 'predict', 'POST', get_prediction_url(model), body, model=model or 'default',
+                         intended=intended)
+    return parse_prediction(content)
+
+
+async def analyze(session, endpoint, predictions, intended=None):
+    url = get_url('localhost', ANALYTICS_PORT, '/api/' + endpoint)
+    logging.info(f"{endpoint}: {predictions}")
+    await send(session, endpoint, METHODS[endpoint], url, dict(predictions=predictions),
+               intended=intended)
+
+
+class Engine:
+    """
+    Non-blocking load generation sharing one connection pool, so a single process keeps thousands of
+    requests in flight. Requests that nothing waits for run as background tasks like on the executor of run().
+    """
+
+    def __init__(self, session):
+        self.session = session
+        self.tasks = set()
+        self.predictions = [None] * len(prediction_models)  # latest predictions, for the open loop
+        self.rounds = {}                                    # round -> prediction tasks, for workloads
+        self.waiting = {}                                   # round -> analytics requests still to send
+
+    def submit(self, coroutine):
+        task = asyncio.create_task(coroutine)
+        self.tasks.add(task)
+        task.add_done_callback(self.finish_task)
+        return task
+
+    def finish_task(self, task):
+        """
+        Record a background task failing unexpectedly as an error of the engine, so the run goes on.
+        """
+        self.tasks.discard(task)
+        if task.cancelled() or task.exception() is None:
+            return
+        err = task.exception()
+        logging.error(f"Background task failed: {err!r}")
+        now = time.monotonic()
+        recorder.record('engine', None, type(err).__name__, now, now, now)
+
+    async def run_user(self, think_time, stop_at):
+        """
+        Simulate a user like run(): detect an anomaly, predict with all prediction models,
+        then assess the predictions, get the accurate one and the valid ones, every think time seconds.
+        """
+        date_start = datetime(1971, 1, 1)
+        date_step = relativedelta(years=1)
+        date_end = date_start
+        await asyncio.sleep(random.uniform(0, think_time))  # users do not start in lockstep
+        intended = time.monotonic() + think_time
+        while intended < stop_at:
+            await asyncio.sleep(think_time)
+            round_start = time.monotonic()
+            date_end = date_end + date_step
+            self.submit(detect_anomaly(self.session, bool(random.getrandbits(1)), date_start, date_end, intended))
+            body = get_random_prediction_body(date_start, date_end)
+            log_prediction_body(body)
+            predictions = await asyncio.gather(*(predict(self.session, model, body, intended)
+                                                 for model in prediction_models))
+            if any(prediction is not None for prediction in predictions):
+                for endpoint in ANALYTICS_ENDPOINTS:
+                    self.submit(analyze(self.session, endpoint, predictions))
+            intended = round_start + think_time
+
+    async def run_users(self, users, duration, think_time=STEP_INTERVAL):
+        stop_at = time.monotonic() + duration
+        await asyncio.gather(*(self.run_user(think_time, stop_at) for _ in range(users)))
+
+    async def send_open_loop(self, endpoint, date_start, date_end, intended):
+        predictions = list(self.predictions)
+        if endpoint == 'detectAnomaly':
+            await detect_anomaly(self.session, bool(random.getrandbits(1)), date_start, date_end, intended)
+        elif endpoint == 'predict' or all(prediction is None for prediction in predictions):
+            model = random.choice(prediction_models)
+            body = get_random_prediction_body(date_start, date_end)
+            log_prediction_body(body)
+            prediction = await predict(self.session, model, body, intended)
+            if prediction is not None:
+                self.predictions[prediction_models.index(model)] = prediction
+        else:
+            await analyze(self.session, endpoint, predictions, intended)
+
+    async def run_open_loop(self, rate, duration, arrivals=POISSON, mix=ENDPOINT_MIX, start=None, phase=0.0):
+        """
+        Send requests at their intended send times like OpenLoop, without a thread per request in flight.
+        The schedule begins at the monotonic time start, by default now, and is shifted by phase seconds,
+        so shards sending at constant arrivals interleave.
+        """
+        date_start = datetime(1971, 1, 1)
+        date_step = relativedelta(years=1)
+        endpoints = list(mix.keys())
+        weights = list(mix.values())
+        start = start or time.monotonic()
+        scheduled = phase  # intended send time relative to start
+        sent = late = 0
+        for interarrival_time in get_interarrival_times(rate, arrivals):
+            scheduled += interarrival_time
+            if scheduled >= duration:
+                break
+            delay = start + scheduled - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            elif -delay > MAX_SEND_LAG:
+                late += 1
+            date_end = date_start + date_step * (1 + int(scheduled // STEP_INTERVAL))
+            endpoint = random.choices(endpoints, weights)[0]
+            self.submit(self.send_open_loop(endpoint, date_start, date_end, start + scheduled))
+            sent += 1
+        logging.info(f"Sent {sent} requests in {time.monotonic() - start:.1f} seconds, {late} late")
+
+    async def send_compiled(self, request, intended):
+        """
+        Send a request of a workload to the gateway, if given, or to the Istio ingress. Analytics requests
+        of a round wait for the predictions of the round and are sent when they arrive, like in run().
+        """
+        url = get_url('localhost', PORTS[request.endpoint], request.path)
+        if request.endpoint == 'predict':
+            content = await send(self.session, request.endpoint, METHODS[request.endpoint], url, None,
+                                 model=request.model or 'default', intended=intended, data=request.body)
+            prediction = parse_prediction(content)
+            if prediction is not None:
+                self.predictions[prediction_models.index(request.model)] = prediction
+            return prediction
+        if request.body is not None:
+            await send(self.session, request.endpoint, METHODS[request.endpoint], url, None,
+                       intended=intended, data=request.body)
+            return None
+        if request.round_id == NO_ROUND:
+            # without any prediction yet, a prediction is sent instead, like in OpenLoop
+            await self.send_open_loop(request.endpoint, *get_dates(request.offset), intended)
+            return None
+        predictions = await asyncio.gather(*self.rounds[request.round_id])
+        self.waiting[request.round_id] -= 1
+        if self.waiting[request.round_id] == 0:
+            del self.rounds[request.round_id]
+            del self.waiting[request.round_id]
+        if any(prediction is not None for prediction in predictions):
+            await analyze(self.session, request.endpoint, predictions)
+        return None
+
+    async def run_workload(self, workload):
+        """
+        Send the requests of a compiled workload at their offsets, with no generation work while sending.
+        """
+        start = time.monotonic()
+        late = 0
+        for request in workload.requests:
+            delay = start + request.offset - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            elif -delay > MAX_SEND_LAG:
+                late += 1
+            task = self.submit(self.send_compiled(request, start + request.offset))
+            if request.round_id != NO_ROUND:
+                if request.endpoint == 'predict':
+                    self.rounds.setdefault(request.round_id, []).append(task)
+                else:
+                    self.waiting[request.round_id] = self.waiting.get(request.round_id, 0) + 1
+        logging.info(f"Sent {len(workload.requests)} requests in {time.monotonic() - start:.1f} seconds, "
+                     f"{late} late")
+
+    async def run_replay(self, requests, speed=1.0, target=REPLAY_TARGET, max_in_flight=MAX_CONNECTIONS):
+        """
+        Replay logged requests at speed times their original pace, so their relative timing and concurrency
+        are preserved, or as fast as possible with at most max_in_flight requests in flight at MAX_SPEED.
+        Latencies are recorded per original request class.
+        """
+        semaphore = asyncio.Semaphore(max_in_flight)
+        start = time.monotonic()
+        sent = late = 0
+        for request in requests:
+            if speed == MAX_SPEED:
+                await semaphore.acquire()
+                intended = time.monotonic()
+            else:
+                intended = start + request.offset / speed
+                delay = intended - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                elif -delay > MAX_SEND_LAG:
+                    late += 1
+            url = target + request.path + ('?' + request.query if request.query else '')
+            task = self.submit(send(self.session, request.request_class, request.method, url, None,
+                                    model=request.model, intended=intended, data=request.data))
+            if speed == MAX_SPEED:
+                task.add_done_callback(lambda _: semaphore.release())
+            sent += 1
+        logging.info(f"Replayed {sent} requests in {time.monotonic() - start:.1f} seconds, {late} late")
+
+    async def wait(self):
+        """
+        Wait for the requests still in flight. Their failures are recorded by finish_task.
+        """
+        while self.tasks:
+            await asyncio.gather(*self.tasks, return_exceptions=True)
+
+
+async def run(users=None, duration=600, think_time=STEP_INTERVAL, rate=None, arrivals=POISSON, mix=ENDPOINT_MIX,
+              max_connections=MAX_CONNECTIONS, generate=True, workload=None, shard=0, shards=1, replay=None,
+              speed=1.0, target=REPLAY_TARGET, ramp=None, start=None, phase=0.0):
+    """
+    Simulate the given number of users, or send requests at the given rate per second, for duration seconds.
+    A compiled workload file is sent instead if given, or a request log is replayed at the given speed,
+    or the given shard of them, or the rate follows a step ramp whose results are provided.
+    """
+    if workload is not None:
+        workload = read_workload(workload).get_shard(shard, shards)
+    connector = TCPConnector(limit=max_connections)
+    async with ClientSession(connector=connector, timeout=ClientTimeout(total=None)) as session:
+        engine = Engine(session)
+        # the data generation runs for minutes, so it must not hold up the end of the run
+        generate = generate and replay is None and ramp is None
+        if generate:
+            generation = asyncio.create_task(generate_data(session, data_types[0], IOT_PORTS[0]))
+        result = None
+        if ramp is not None:
+            result = await ramp.run(engine, arrivals, mix)
+        elif replay is not None:
+            await engine.run_replay(read_log(replay, shard, shards), speed, target, max_connections)
+        elif workload is not None:
+            await engine.run_workload(workload)
+        elif rate is None:
+            await engine.run_users(users, duration, think_time)
+        else:
+            await engine.run_open_loop(rate, duration, arrivals, mix, start, phase)
+        await engine.wait()
+        if generate:
+            generation.cancel()
+        return result
+
+
+def run_shard(settings):
+    """
+    Run a shard of the load in a worker process and provide what it recorded.
+    The gateway is passed with the settings, since spawned workers do not inherit the globals of the parent.
+    """
+    random.seed()  # forked workers must not repeat the random choices of each other
+    runner.gateway = settings.pop('gateway')
+    asyncio.run(run(**settings))
+    return recorder.get_state()
+
+
+def run_sharded(processes, users=None, duration=600, think_time=STEP_INTERVAL, rate=None, arrivals=POISSON,
+                mix=ENDPOINT_MIX, max_connections=MAX_CONNECTIONS, workload=None, replay=None, speed=1.0,
+                target=REPLAY_TARGET, gateway=None):
+    """
+    Split the users, the rate or the workload and the connections across worker processes, so load generation
+    scales with the cores, and merge the recorded latencies and statuses into the recorder of this process.
+    The sum of Poisson arrivals of the shards are Poisson arrivals at the total rate, and constant arrivals
+    of the shards are shifted by one gap at the total rate per shard, so they do not arrive in bursts.
+    The shards start their schedules at the same time, once all workers are likely to be up.
+    """
+    start = time.monotonic() + SHARD_STARTUP
+    shards = []
+    for shard in range(processes):
+        shards.append(dict(users=users // processes + (shard < users % processes) if users is not None else None,
+                           duration=duration, think_time=think_time,
+                           rate=rate / processes if rate is not None else None, arrivals=arrivals, mix=mix,
+                           max_connections=max(max_connections // processes, 1), generate=shard == 0,
+                           workload=workload, shard=shard, shards=processes, replay=replay, speed=speed,
+                           target=target, gateway=gateway, start=start,
+                           phase=shard / rate if rate is not None else 0.0))
+    with multiprocessing.Pool(processes) as pool:
+        for state in pool.map(run_shard, shards):
+            recorder.merge(state)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate client activity with non-blocking requests.")
+    parser.add_argument('--gateway', help="host:port of the API gateway, instead of the Istio ingress")
+    parser.add_argument('--users', type=int, default=1000, help="virtual users running the scenario of run()")
+    parser.add_argument('--think-time', type=float, default=STEP_INTERVAL, help="in seconds, between rounds")
+    parser.add_argument('--rate', type=parse_rate,
+                        help="requests per second sent in an open loop, instead of simulating users")
+    parser.add_argument('--duration', type=float, default=600, help="in seconds")
+    parser.add_argument('--arrivals', choices=(POISSON, CONSTANT), default=POISSON)
+    parser.add_argument('--mix', type=parse_mix, default=ENDPOINT_MIX,
+                        help="relative weights of the endpoints, e.g. predict=3,detectAnomaly=1")
+    parser.add_argument('--workload', help="workload file compiled by workload.py, sent instead of simulating users")
+    parser.add_argument('--replay', help="JSONL request log with method, path, query, body and timestamp to replay")
+    parser.add_argument('--speed', type=parse_speed, default=1.0,
+                        help="replay speed, a multiple of the original pace like 1 or 10x, or max")
+    parser.add_argument('--target', help=f"base URL for replayed requests, the gateway if given, "
+                                          f"{REPLAY_TARGET} otherwise")
+    parser.add_argument('--ramp', type=parse_ramp,
+                        help="step load with start, step and maximum rate in requests per second, e.g. 10,10,500")
+    parser.add_argument('--slo-p99', type=float, default=1000, help="in milliseconds, p99 bound of the ramp")
+    parser.add_argument('--slo-error-rate', type=float, default=0.01, help="error rate bound of the ramp")
+    parser.add_argument('--window', type=float, default=10, help="in seconds, measurement window of the ramp")
+    parser.add_argument('--stop', choices=(ANY, ALL), default=ANY,
+                        help="stop the ramp when any or all endpoints breached the SLO")
+    parser.add_argument('--ramp-report', help="JSON file to write the steps and knees of the ramp to")
+    parser.add_argument('--max-connections', type=int, default=MAX_CONNECTIONS)
+    parser.add_argument('--processes', type=int, default=1,
+                        help="worker processes sharing the users, the rate and the connections")
+    parser.add_argument('--report', action='append', default=[],
+                        help="file to write the latency report to at the end of the run, .json or .csv")
+    args = parser.parse_args()
+    if args.ramp is not None and args.processes > 1:
+        parser.error("--ramp runs in a single process, since each step needs the stats of all requests")
+    runner.gateway = args.gateway
+    if args.target is None:
+        args.target = f"http://{args.gateway}" if args.gateway is not None else REPLAY_TARGET
+    try:
+        if args.ramp is not None:
+            ramp = StepRamp(*args.ramp, max_p99=args.slo_p99, max_error_rate=args.slo_error_rate,
+                            window=args.window, stop=args.stop)
+            result = asyncio.run(run(arrivals=args.arrivals, mix=args.mix, max_connections=args.max_connections,
+                                     ramp=ramp))
+            for key, knee in result['knees'].items():
+                logging.info(f"Knee of {key}: {knee}")
+            if args.ramp_report:
+                with open(args.ramp_report, 'w') as file:
+                    json.dump(result, file, indent=2)
+        elif args.processes > 1:
+            run_sharded(args.processes, args.users, args.duration, args.think_time, args.rate, args.arrivals,
+                        args.mix, args.max_connections, args.workload, args.replay, args.speed, args.target,
+                        args.gateway)
+        else:
+            asyncio.run(run(args.users, args.duration, args.think_time, args.rate, args.arrivals, args.mix,
+                            args.max_connections, workload=args.workload, replay=args.replay, speed=args.speed,
+                            target=args.target))
+    except KeyboardInterrupt:
+        logging.info("Stopped")
+    finally:
+        # what was recorded up to a failure is still reported
+        finish(args.report)
+
+
+if __name__ == '__main__':
+    logging.getLogger().setLevel(logging.DEBUG)
+    main()
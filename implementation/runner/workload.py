@@ -0,0 +1,238 @@
+import argparse
+import gzip
+import json
+import logging
+import random
+import struct
+from datetime import datetime
+
+from dateutil.relativedelta import relativedelta
+
+from runner import ANALYTICS_PORT, ANOMALY_DETECTION_PORT, CONSTANT, ENDPOINT_MIX, POISSON, PREDICTION_PORT, \
+    STEP_INTERVAL, prediction_models, get_anomaly_path, get_random_prediction_body, get_prediction_path, \
+    get_interarrival_times, check_mix, parse_rate
+
+MAGIC = b'WKLD2'
+HEADER = struct.Struct('<I')            # length of the JSON header
+RECORD = struct.Struct('<dBBHiI')       # offset, endpoint, model, path, round, body length
+
+# methods of the endpoints
+METHODS = dict(detectAnomaly='POST', predict='POST', assessPredictions='POST', getAccuratePrediction='POST',
+               getValidPredictions='DELETE')
+# ports of the endpoints, used when the requests are sent without a gateway
+PORTS = dict(detectAnomaly=ANOMALY_DETECTION_PORT, predict=PREDICTION_PORT, assessPredictions=ANALYTICS_PORT,
+             getAccuratePrediction=ANALYTICS_PORT, getValidPredictions=ANALYTICS_PORT)
+ANALYTICS_ENDPOINTS = ['assessPredictions', 'getAccuratePrediction', 'getValidPredictions']
+
+NO_ROUND = -1  # analytics requests without a round use the latest predictions
+
+
+class Request:
+    def __init__(self, offset, endpoint, model, path, round_id, body):
+        self.offset = offset        # float, intended send time in seconds from the start of the run
+        self.endpoint = endpoint    # string
+        self.model = model          # string or None
+        self.path = path            # string, path and query, the host is chosen when the request is sent
+        self.round_id = round_id    # int, round of a user, whose predictions the analytics requests use
+        self.body = body            # bytes, encoded JSON, None for analytics requests
+
+
+class Workload:
+    """
+    Request stream compiled from a scenario spec and a seed, so a run spends no time on generating requests
+    and can be repeated exactly. The bodies of analytics requests depend on the predictions received
+    and are the only ones encoded while running. Requests have paths only, so a workload runs against any target.
+    """
+
+    def __init__(self, seed, spec, requests):
+        self.seed = seed            # int
+        self.spec = spec            # dict
+        self.requests = requests    # list of Request, ordered by offset
+
+    def get_shard(self, shard, shards):
+        """
+        Split the requests across processes, keeping the requests of a round together.
+        """
+        requests = [request for index, request in enumerate(self.requests)
+                    if (request.round_id if request.round_id != NO_ROUND else index) % shards == shard]
+        return Workload(self.seed, self.spec, requests)
+
+
+def encode(body):
+    return json.dumps(body, separators=(',', ':')).encode()
+
+
+def get_dates(offset):
+    date_start = datetime(1971, 1, 1)
+    return date_start, date_start + relativedelta(years=1) * (1 + int(offset // STEP_INTERVAL))
+
+
+def compile_open_loop(spec, rng, today):
+    """
+    Compile requests at Poisson or constant arrivals over a weighted endpoint mix like OpenLoop.
+    """
+    mix = spec.get('mix', ENDPOINT_MIX)
+    endpoints = list(mix.keys())
+    weights = list(mix.values())
+    requests = []
+    offset = 0.0
+    predicted = False
+    for interarrival_time in get_interarrival_times(spec['rate'], spec.get('arrivals', POISSON), rng):
+        offset += interarrival_time
+        if offset >= spec['duration']:
+            break
+        date_start, date_end = get_dates(offset)
+        endpoint = rng.choices(endpoints, weights)[0]
+        if endpoint == 'detectAnomaly':
+            path, body = get_anomaly_path(bool(rng.getrandbits(1)), date_start, date_end, rng)
+            requests.append(Request(offset, endpoint, None, path, NO_ROUND, encode(body)))
+        elif endpoint == 'predict' or not predicted:
+            model = rng.choice(prediction_models)
+            body = get_random_prediction_body(date_start, date_end, rng, today)
+            requests.append(Request(offset, 'predict', model, get_prediction_path(model), NO_ROUND, encode(body)))
+            predicted = True
+        else:
+            requests.append(Request(offset, endpoint, None, '/api/' + endpoint, NO_ROUND, None))
+    return requests
+
+
+def compile_users(spec, rng, today):
+    """
+    Compile the rounds of users like run(): an anomaly detection, a prediction per prediction model and
+    the analytics requests on these predictions, every think time seconds.
+    """
+    think_time = spec.get('think_time', STEP_INTERVAL)
+    requests = []
+    round_id = 0
+    for user in range(spec['users']):
+        offset = rng.uniform(0, think_time) + think_time
+        round_number = 0
+        while offset < spec['duration']:
+            date_start = datetime(1971, 1, 1)
+            date_end = date_start + relativedelta(years=1) * (round_number + 1)
+            path, body = get_anomaly_path(bool(rng.getrandbits(1)), date_start, date_end, rng)
+            requests.append(Request(offset, 'detectAnomaly', None, path, NO_ROUND, encode(body)))
+            body = encode(get_random_prediction_body(date_start, date_end, rng, today))
+            for model in prediction_models:
+                requests.append(Request(offset, 'predict', model, get_prediction_path(model), round_id, body))
+            for endpoint in ANALYTICS_ENDPOINTS:
+                requests.append(Request(offset, endpoint, None, '/api/' + endpoint, round_id, None))
+            round_id += 1
+            round_number += 1
+            offset += think_time
+    requests.sort(key=lambda request: request.offset)
+    return requests
+
+
+def parse_spec(text):
+    """
+    Parse a scenario spec and check it like the runner checks its arguments.
+    """
+    try:
+        spec = json.loads(text)
+    except ValueError as err:
+        raise argparse.ArgumentTypeError(f"Invalid JSON: {err}")
+    if not isinstance(spec, dict):
+        raise argparse.ArgumentTypeError(f"Expected a JSON object, got {text}")
+    if not isinstance(spec.get('duration'), (int, float)) or spec['duration'] <= 0:
+        raise argparse.ArgumentTypeError(f"Expected a positive duration in seconds, got {spec.get('duration')}")
+    if 'users' in spec:
+        if not isinstance(spec['users'], int) or spec['users'] <= 0:
+            raise argparse.ArgumentTypeError(f"Expected a positive number of users, got {spec['users']}")
+        think_time = spec.get('think_time', STEP_INTERVAL)
+        if not isinstance(think_time, (int, float)) or think_time <= 0:
+            raise argparse.ArgumentTypeError(f"Expected a positive think time in seconds, got {think_time}")
+    elif 'rate' in spec:
+        if not isinstance(spec['rate'], (int, float)):
+            raise argparse.ArgumentTypeError(f"Expected a rate in requests per second, got {spec['rate']}")
+        parse_rate(spec['rate'])
+        if spec.get('arrivals', POISSON) not in (POISSON, CONSTANT):
+            raise argparse.ArgumentTypeError(f"Expected arrivals {POISSON} or {CONSTANT}, got {spec['arrivals']}")
+        mix = spec.get('mix', ENDPOINT_MIX)
+        if not isinstance(mix, dict) or not all(isinstance(weight, (int, float)) for weight in mix.values()):
+            raise argparse.ArgumentTypeError(f"Expected a mix of endpoint weights, got {mix}")
+        check_mix(mix)
+    else:
+        raise argparse.ArgumentTypeError("Expected users or rate in the spec")
+    return spec
+
+
+def compile_workload(seed, spec):
+    """
+    Generate the requests of a scenario spec, either users and think_time, or rate, arrivals and mix,
+    with duration in seconds. today, the latest prediction date, defaults to the current date.
+    """
+    rng = random.Random(seed)
+    spec = dict(spec)
+    spec.setdefault('today', datetime.strftime(datetime.today(), "%Y-%m-%d"))
+    today = datetime.strptime(spec['today'], "%Y-%m-%d")
+    if 'users' in spec:
+        requests = compile_users(spec, rng, today)
+    else:
+        requests = compile_open_loop(spec, rng, today)
+    return Workload(seed, spec, requests)
+
+
+def write_workload(workload, path):
+    """
+    Write a workload as a header with the seed, the spec and the tables of endpoints, models and paths,
+    followed by fixed-size records with the bodies, compressed with gzip.
+    """
+    endpoints = list(METHODS.keys())
+    models = [model or '' for model in prediction_models]
+    paths = sorted({request.path for request in workload.requests})
+    path_indexes = {request_path: index for index, request_path in enumerate(paths)}
+    header = encode(dict(seed=workload.seed, spec=workload.spec, endpoints=endpoints, models=models, paths=paths,
+                         count=len(workload.requests)))
+    # without a file name and modification time, the same seed and spec give the same file
+    with open(path, 'wb') as raw_file, gzip.GzipFile('', 'wb', fileobj=raw_file, mtime=0) as file:
+        file.write(MAGIC)
+        file.write(HEADER.pack(len(header)))
+        file.write(header)
+        for request in workload.requests:
+            body = request.body or b''
+            file.write(RECORD.pack(request.offset, endpoints.index(request.endpoint),
+                                   models.index(request.model or ''), path_indexes[request.path],
+                                   request.round_id, len(body)))
+            file.write(body)
+
+
+def read_workload(path):
+    with gzip.open(path, 'rb') as file:
+        data = file.read()
+    if not data.startswith(MAGIC):
+        raise ValueError(f"{path} is not a workload file")
+    position = len(MAGIC)
+    header_length, = HEADER.unpack_from(data, position)
+    position += HEADER.size
+    header = json.loads(data[position:position + header_length])
+    position += header_length
+    endpoints = header['endpoints']
+    models = [model or None for model in header['models']]
+    paths = header['paths']
+    requests = []
+    for _ in range(header['count']):
+        offset, endpoint, model, path_index, round_id, body_length = RECORD.unpack_from(data, position)
+        position += RECORD.size
+        body = data[position:position + body_length] if body_length else None
+        position += body_length
+        requests.append(Request(offset, endpoints[endpoint], models[model], paths[path_index], round_id, body))
+    return Workload(header['seed'], header['spec'], requests)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compile a scenario into a workload file for the runner.")
+    parser.add_argument('spec', type=parse_spec, help="scenario spec as JSON, e.g. "
+                                     "'{\"rate\": 100, \"duration\": 600, \"mix\": {\"predict\": 1}}' or "
+                                     "'{\"users\": 1000, \"think_time\": 30, \"duration\": 600}'")
+    parser.add_argument('output', help="workload file to write")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    workload = compile_workload(args.seed, args.spec)
+    write_workload(workload, args.output)
+    logging.info(f"Compiled {len(workload.requests)} requests into {args.output}")
+
+
+if __name__ == '__main__':
+    logging.getLogger().setLevel(logging.DEBUG)
+    main()